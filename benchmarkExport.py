@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from mockRentmanApi import MockRentman, start_server
+
+# Runs collectEverything.py end to end against the local mock API (mockRentmanApi.py) and reports
+# articles/second, the time per stage and the peak memory, eg.:
+#   python3 benchmarkExport.py --items 1000 --latency 30 --error-rate 0.01 -- --workers 4 --pdf-engine weasyprint
+# Everything after "--" is passed to collectEverything.py.
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def prepare_work_dir(work_dir):
+    """A folder that looks like a checkout to collectEverything.py: template, JWT_TOKEN, equipmentSheets."""
+    os.makedirs(os.path.join(work_dir, 'equipmentSheets'), exist_ok=True)
+    shutil.copyfile(os.path.join(SCRIPT_DIR, 'equipment-sheet.html'), os.path.join(work_dir, 'equipment-sheet.html'))
+    with open(os.path.join(work_dir, 'JWT_TOKEN'), 'w') as f:
+        f.write('benchmark')
+
+def run_export(work_dir, base_url, export_args):
+    """Run one export; returns (seconds, exit code, metrics written by --metrics, peak RSS in MB)."""
+    metrics_path = os.path.join(work_dir, 'metrics.json')
+    if os.path.exists(metrics_path):
+        os.remove(metrics_path)
+    command = [sys.executable, os.path.join(SCRIPT_DIR, 'collectEverything.py'), '--metrics', metrics_path] + export_args
+    started = time.monotonic()
+    with tempfile.TemporaryFile(mode='w+') as stderr:
+        process = subprocess.Popen(command, cwd=work_dir, env=dict(os.environ, RENTMAN_BASE_URL=base_url),
+                                   stdout=subprocess.DEVNULL, stderr=stderr)
+        # The usage of this one run: the biggest resident set of the export and its render processes, in KB on Linux
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        elapsed = time.monotonic() - started
+        if process.returncode != 0:
+            stderr.seek(0)
+            print(stderr.read()[-2000:])
+    metrics = None
+    if os.path.isfile(metrics_path):
+        with open(metrics_path, 'r') as f:
+            metrics = json.load(f)
+    return elapsed, process.returncode, metrics, usage.ru_maxrss / 1024
+
+def print_report(name, num_items, elapsed, metrics, peak_rss, server_stats):
+    print(f"{name}: {num_items} articles in {elapsed:.1f}s = {num_items / elapsed if elapsed else 0:.1f} articles/s, peak RSS {peak_rss:.0f} MB")
+    print(f"   Mock API: {server_stats.get('api requests', 0)} API calls, {server_stats.get('429 responses', 0)} answered with 429, "
+          f"{server_stats.get('blob requests', 0)} downloads ({server_stats.get('blob bytes', 0) / 1024 ** 2:.1f} MB)")
+    if metrics:
+        for stage, stats in sorted(metrics['stages'].items(), key=lambda entry: -entry[1]['seconds']):
+            print(f"   {stage:<20} {stats['count']:>7} x {stats['seconds'] / stats['count'] * 1000 if stats['count'] else 0:>8.1f} ms = {stats['seconds']:>8.1f}s")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark collectEverything.py against a local mock of the rentman API')
+    parser.add_argument('--items', type=int, help='Number of synthetic equipment articles', default=200)
+    parser.add_argument('--latency', type=float, help='Milliseconds added to every API call', default=0)
+    parser.add_argument('--error-rate', type=float, help='Share of API calls answered with 429 (0-1)', default=0)
+    parser.add_argument('--max-rps', type=int, help='Answer with 429 above this many API calls per second, like rentman (0: no limit)', default=0)
+    parser.add_argument('--warm', action='store_true', help='Run the export a second time in the same folder (nothing changed)')
+    parser.add_argument('--keep', action='store_true', help='Keep the folder of the export')
+    parser.add_argument('--output', type=str, help='Write the results as JSON to this file', default=None)
+    parser.add_argument('export_args', nargs=argparse.REMAINDER, help='Arguments for collectEverything.py (after --)')
+    args = parser.parse_args()
+    export_args = [arg for arg in args.export_args if arg != '--']
+
+    print(f"Creating {args.items} synthetic articles…")
+    server = start_server(MockRentman(args.items), latency=args.latency / 1000, error_rate=args.error_rate, max_rps=args.max_rps)
+    work_dir = tempfile.mkdtemp(prefix='rentman-benchmark-')
+    prepare_work_dir(work_dir)
+
+    results = []
+    for name in (['cold', 'warm'] if args.warm else ['cold']):
+        with server.stats_lock:
+            server.stats.clear()
+        elapsed, returncode, metrics, peak_rss = run_export(work_dir, server.mock.base_url, export_args)
+        if returncode != 0:
+            print(f"{name}: collectEverything.py failed with exit code {returncode}")
+        print_report(name, args.items, elapsed, metrics, peak_rss, server.stats)
+        results.append({'run': name, 'items': args.items, 'seconds': elapsed, 'items_per_second': args.items / elapsed if elapsed else 0,
+                        'peak_rss_mb': peak_rss, 'exit_code': returncode, 'mock_api': dict(server.stats), 'metrics': metrics})
+
+    server.shutdown()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'arguments': vars(args), 'results': results}, f, indent=4)
+        print(f"Results written to {args.output}")
+    if args.keep:
+        print(f"Export kept in {work_dir}")
+    else:
+        shutil.rmtree(work_dir, ignore_errors=True)
@@ -0,0 +1,122 @@
+import errno
+import fcntl
+import hashlib
+import os
+import shutil
+import sqlite3
+import threading
+import time
+
+# Lives next to the "equipmentDump" folder
+CACHE_DIR = 'downloadCache'
+
+# Last use of every cached file, for the eviction. Not the mtime of the files: they are
+# hardlinked into the equipment folders, touching them would change the exported files.
+USAGE_DB = 'usage.sqlite'
+
+# Linux ioctl to clone a file (copy on write) on btrfs, xfs, ..
+FICLONE = 0x40049409
+
+
+def link_or_copy(source_path, target_path):
+    """
+    Make target_path have the content of source_path without copying the bytes if possible:
+    reflink (copy on write) where the file system supports it, else a hardlink, else a copy.
+    The target is replaced atomically.
+    """
+    if os.path.lexists(target_path) and os.path.samefile(source_path, target_path):
+        return  # Already a hardlink of source_path (a rename onto it would leave the tmp file behind)
+    tmp_path = f"{target_path}.{threading.get_ident()}.tmp"
+    if os.path.lexists(tmp_path):
+        os.remove(tmp_path)
+    try:
+        with open(source_path, 'rb') as src, open(tmp_path, 'wb') as dst:
+            fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    except OSError:
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+        try:
+            os.link(source_path, tmp_path)
+        except OSError as e:
+            if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK, errno.ENOTSUP):
+                raise
+            shutil.copyfile(source_path, tmp_path)
+    os.replace(tmp_path, target_path)
+
+
+class BlobCache:
+    """
+    Cache of downloaded files, keyed by the rentman file id and its "modified" date.
+    A file that did not change in rentman is never downloaded again, even if the equipment
+    folder is renamed (other category) or exported with --overwrite: it is linked from here.
+    The least recently used files are evicted when the cache grows bigger than max_bytes.
+    Safe to share between worker threads.
+    """
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=20 * 1024 ** 3):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(os.path.join(cache_dir, USAGE_DB), check_same_thread=False)
+        self.db.execute("CREATE TABLE IF NOT EXISTS usage (blob TEXT PRIMARY KEY, used_at REAL)")
+        self.db.commit()
+
+    def mark_used(self, blob):
+        with self.lock, self.db:
+            self.db.execute("INSERT OR REPLACE INTO usage (blob, used_at) VALUES (?, ?)", (os.path.relpath(blob, self.cache_dir), time.time()))
+
+    def blob_path(self, file_data):
+        modified = hashlib.sha1(str(file_data.get('modified')).encode()).hexdigest()[:12]
+        key = f"{file_data['id']}-{modified}"
+        return os.path.join(self.cache_dir, key[-2:], key)
+
+    def link_from_cache(self, file_data, target_path):
+        """Put the cached file at target_path. False if it is not in the cache."""
+        blob = self.blob_path(file_data)
+        if not os.path.isfile(blob):
+            return False
+        if file_data.get('size') and os.path.getsize(blob) != file_data['size']:
+            os.remove(blob)  # Broken cache entry
+            return False
+        link_or_copy(blob, target_path)
+        self.mark_used(blob)  # For the eviction
+        return True
+
+    def add(self, file_data, source_path):
+        """Store a freshly downloaded file in the cache."""
+        blob = self.blob_path(file_data)
+        os.makedirs(os.path.dirname(blob), exist_ok=True)
+        link_or_copy(source_path, blob)
+        self.mark_used(blob)
+
+    def evict(self):
+        """Remove the least recently used files until the cache is smaller than max_bytes."""
+        with self.lock:
+            used_at = dict(self.db.execute("SELECT blob, used_at FROM usage"))
+        blobs = []
+        for dirpath, _, filenames in os.walk(self.cache_dir):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                if dirpath == self.cache_dir:
+                    continue  # The usage database, blobs are in sub folders
+                stat = os.stat(path)
+                key = os.path.relpath(path, self.cache_dir)
+                blobs.append((used_at.get(key, stat.st_mtime), stat.st_size, key))
+        total = sum(size for _, size, _ in blobs)
+        removed = []
+        for _, size, key in sorted(blobs):
+            if total <= self.max_bytes:
+                break
+            os.remove(os.path.join(self.cache_dir, key))
+            total -= size
+            removed.append(key)
+        with self.lock, self.db:
+            self.db.executemany("DELETE FROM usage WHERE blob = ?", [(key,) for key in removed])
+            # Files removed by hand
+            keys = {key for _, _, key in blobs}
+            self.db.executemany("DELETE FROM usage WHERE blob = ?", [(key,) for key in used_at if key not in keys])
+        return len(removed)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
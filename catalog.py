@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import threading
+
+# One database with all exported equipment, for frontends and scripts
+CATALOG_DB = os.path.join('equipmentDump', 'catalog.sqlite')
+
+# Columns of the equipment table that are copied from the rentman data (besides id and the full json)
+EQUIPMENT_COLUMNS = ('code', 'qrcodes', 'qrcodes_of_serial_numbers', 'name', 'displayname', 'folder_path', 'in_archive',
+                     'length', 'width', 'height', 'weight', 'current_quantity', 'tags', 'modified')
+
+
+class Catalog:
+    """
+    SQLite catalog of all exported equipment, updated in place whenever an equipment is exported.
+
+    Tables:
+        equipment       one row per equipment, indexed columns + the complete data as json
+                        + local_folder (the folder in equipmentDump)
+        custom_fields   one row per custom field ("Extra Input Fields") of an equipment
+        files           one row per downloaded file
+        equipment_fts   full text index over name, tags, category and custom fields
+
+    Example: SELECT e.code, e.name FROM equipment_fts JOIN equipment e ON e.id = equipment_fts.rowid
+             WHERE equipment_fts MATCH 'Sessel'
+    Safe to share between worker threads.
+    """
+    def __init__(self, db_path=CATALOG_DB):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript(f"""
+            CREATE TABLE IF NOT EXISTS equipment (
+                id INTEGER PRIMARY KEY,
+                {', '.join(EQUIPMENT_COLUMNS)},
+                local_folder TEXT,
+                data TEXT
+            );
+            CREATE INDEX IF NOT EXISTS equipment_code ON equipment (code);
+            CREATE INDEX IF NOT EXISTS equipment_qrcodes ON equipment (qrcodes);
+            CREATE INDEX IF NOT EXISTS equipment_folder_path ON equipment (folder_path);
+            CREATE INDEX IF NOT EXISTS equipment_in_archive ON equipment (in_archive);
+            CREATE INDEX IF NOT EXISTS equipment_dimensions ON equipment (length, width, height);
+            CREATE TABLE IF NOT EXISTS custom_fields (
+                equipment_id INTEGER,
+                field TEXT,
+                label TEXT,
+                value TEXT
+            );
+            CREATE INDEX IF NOT EXISTS custom_fields_equipment_id ON custom_fields (equipment_id);
+            CREATE INDEX IF NOT EXISTS custom_fields_value ON custom_fields (field, value);
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                equipment_id INTEGER,
+                filename TEXT,
+                local_path TEXT,
+                type TEXT,
+                size INTEGER,
+                modified TEXT,
+                original_url TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_equipment_id ON files (equipment_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS equipment_fts USING fts5 (name, displayname, tags, folder_path, custom);
+        """)
+        self.db.commit()
+
+    def is_empty(self):
+        with self.lock:
+            return self.db.execute("SELECT COUNT(*) FROM equipment").fetchone()[0] == 0
+
+    def update_item(self, item, local_folder, files_list, field_labels=None):
+        """Insert or replace one equipment with its custom fields and files (one transaction)."""
+        field_labels = field_labels or {}
+        custom = item.get('custom') or {}
+        with self.lock, self.db:
+            self.delete_rows(item['id'])
+            self.db.execute(
+                f"INSERT INTO equipment (id, {', '.join(EQUIPMENT_COLUMNS)}, local_folder, data) VALUES ({', '.join('?' * (len(EQUIPMENT_COLUMNS) + 3))})",
+                (item['id'], *[item.get(column) for column in EQUIPMENT_COLUMNS], local_folder, json.dumps(item))
+            )
+            self.db.executemany(
+                "INSERT INTO custom_fields (equipment_id, field, label, value) VALUES (?, ?, ?, ?)",
+                [(item['id'], field, field_labels.get(field, field), str(value)) for field, value in custom.items()]
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files (id, equipment_id, filename, local_path, type, size, modified, original_url) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(file['data']['id'], item['id'], file['filename'], os.path.join(local_folder, file['local_path']), file['data'].get('type'),
+                  file['data'].get('size'), file['data'].get('modified'), file['original_url']) for file in files_list]
+            )
+            self.db.execute(
+                "INSERT INTO equipment_fts (rowid, name, displayname, tags, folder_path, custom) VALUES (?, ?, ?, ?, ?, ?)",
+                (item['id'], item.get('name'), item.get('displayname'), item.get('tags'), item.get('folder_path'),
+                 ' '.join(str(value) for value in custom.values()))
+            )
+
+    def remove_item(self, equipment_id):
+        """Remove an equipment that no longer exists in rentman."""
+        with self.lock, self.db:
+            self.delete_rows(equipment_id)
+
+    def delete_rows(self, equipment_id):
+        self.db.execute("DELETE FROM equipment WHERE id = ?", (equipment_id,))
+        self.db.execute("DELETE FROM custom_fields WHERE equipment_id = ?", (equipment_id,))
+        self.db.execute("DELETE FROM files WHERE equipment_id = ?", (equipment_id,))
+        self.db.execute("DELETE FROM equipment_fts WHERE rowid = ?", (equipment_id,))
+
+    def close(self):
+        with self.lock:
+            self.db.close()
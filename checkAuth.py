@@ -1,8 +1,15 @@
 import requests
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import runMetrics
+from rentmanApi import BASE_URL, api_get, endpoint_name, endpoint_stats, rate_limiter
+
+# Calls made to measure the latency and the throughput the API sustains right now
+PROBE_REQUESTS = 30
+PROBE_WORKERS = 4
 
 # Constants
-BASE_URL = 'https://api.rentman.net'
 JWT_TOKEN = ''  # Placeholder for the JWT token
 
 def load_jwt_token(file_path):
@@ -20,12 +27,9 @@ def load_jwt_token(file_path):
 # Function to make a test API call
 def test_api_call(jwt_token_local):
     url = f"{BASE_URL}/contacts"  # Adjust the endpoint if needed
-    headers = {
-        'Authorization': f"Bearer {jwt_token_local}"
-    }
     
     try:
-        response = requests.get(url, headers=headers)
+        response = api_get(url, jwt_token_local)
         if response.status_code == 200:
             # print("API call successful!")
             return True
@@ -38,6 +42,41 @@ def test_api_call(jwt_token_local):
         # print(f"Request failed: {e}")
         return False
 
+def measure_api(jwt_token_local, num_requests=PROBE_REQUESTS, workers=PROBE_WORKERS):
+    """
+    Make num_requests small calls from several threads through the adaptive rate limiter (see rentmanApi.py):
+    returns the latency of the calls (without the wait for the rate limiter), the requests/second
+    that were achieved, the retries (429 ..), the calls that failed and the rate the limiter settled on.
+    The limiter starts at the limit of rentman (MAX_REQUESTS_PER_SECOND) instead of half of it, so the
+    requests/second show what the API sustains up to that limit; it never goes above it.
+    """
+    url = f"{BASE_URL}/contacts"
+    endpoint = endpoint_name(url)
+    runMetrics.latencies.pop(endpoint, None)  # Only the probe calls, not test_api_call
+    retries_before = endpoint_stats.get(endpoint, {}).get('retries', 0)
+    with rate_limiter.lock:
+        rate_limiter.rate = rate_limiter.max_rate  # Backs off by itself if the API throttles
+
+    def probe(_):
+        try:
+            return api_get(url, jwt_token_local, params={"limit": 1}).status_code
+        except requests.exceptions.RequestException:
+            return None  # Retries exhausted (connection lost, 5xx ..), counted as failed
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        status_codes = list(executor.map(probe, range(num_requests)))
+    elapsed = time.monotonic() - started
+    latencies = runMetrics.latencies.get(endpoint, [])
+    return {
+        'latency_p50': runMetrics.percentile(latencies, 0.5),
+        'latency_p95': runMetrics.percentile(latencies, 0.95),
+        'requests_per_second': num_requests / elapsed,
+        'retries': endpoint_stats.get(endpoint, {}).get('retries', 0) - retries_before,
+        'failed': sum(1 for status_code in status_codes if status_code != 200),
+        'rate_limit': rate_limiter.rate,
+    }
+
 # Main script
 if __name__ == '__main__':
     JWT_TOKEN = load_jwt_token('JWT_TOKEN')
@@ -45,6 +84,12 @@ if __name__ == '__main__':
     if JWT_TOKEN:
         success = test_api_call(JWT_TOKEN)  # Perform a test API call with the JWT
         if success:
+            measured = measure_api(JWT_TOKEN)  # How fast can we go right now?
+            print(f"API latency {measured['latency_p50'] * 1000:.0f} ms (p50), {measured['latency_p95'] * 1000:.0f} ms (p95), "
+                  f"{measured['requests_per_second']:.1f} requests/s achieved with {PROBE_WORKERS} threads, "
+                  f"{measured['retries']} retries, rate limiter settled at {measured['rate_limit']:.1f} requests/s")
+            if measured['failed']:
+                print(f"{measured['failed']} of {PROBE_REQUESTS} calls failed")
             sys.exit(0)  # Exit with code 0 if successful
         else:
             sys.exit(1)  # Exit with code 1 if failed
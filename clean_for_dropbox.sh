@@ -1,5 +1,8 @@
 #!/bin/bash
 
+# Deletes everything but the allowed extensions in a copy of equipmentDump.
+# publishExport.py does the same without the copy (links or archives, only what changed).
+
 # Check if a folder path was provided
 if [ -z "$1" ]; then
   echo "Usage: $0 <root_folder>"
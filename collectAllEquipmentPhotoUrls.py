@@ -1,75 +1,132 @@
-import requests
+import argparse
 import json
-import time
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from checkAuth import load_jwt_token
+from rentmanApi import BASE_URL, api_get_json, api_list, file_head, print_request_stats
+from fileDownloads import etag_md5
+
+# Inventory of every file attached to equipment in rentman, without downloading anything:
+# one JSON line per file (equipment, file id, url, size, modified, optionally ETag and size of
+# the amazonS3 object), written while the pages arrive. For storage planning, to see what
+# changed between two inventories, or as the input of a downloader, eg.:
+#   python3 collectAllEquipmentPhotoUrls.py --head --output files.jsonl
+#   python3 collectAllEquipmentPhotoUrls.py --output - | jq -r .url
 
-# Constants for the API endpoints
-BASE_URL = 'https://api.rentman.net'
 JWT_TOKEN = ''  # Create a file called "JWT_TOKEN" (without file extension), put the JWT token there, it will be read by this script and inserted.
 
+# Only what the manifest needs, keeps the pages of the /equipment list small
+EQUIPMENT_FIELDS = ('id', 'code', 'name', 'folder', 'in_archive', 'modified')
+
+# Set up argument parsing
+parser = argparse.ArgumentParser(description='Write a JSON line for every file attached to equipment in rentman.')
+parser.add_argument('--output', type=str, help='Manifest to write ("-": standard output)', default='collectAllEquipmentPhotoUrls.jsonl')
+parser.add_argument('--head', action='store_true', help='Ask amazonS3 for the size and ETag of every file (HEAD, not rate limited)')
+parser.add_argument('--head-workers', type=int, help='Number of HEAD requests at the same time', default=16)
+parser.add_argument('--per-item', action='store_true', help='One /equipment/{id}/files call per equipment instead of paging through /files')
+parser.add_argument('--workers', type=int, help='With --per-item: number of equipment asked for their files at the same time (within the rate limit)', default=4)
+
 # Function to get all equipment
 def get_all_equipment():
-    url = f"{BASE_URL}/equipment"
-    headers = {
-        'Authorization': f"Bearer {JWT_TOKEN}"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json()
+    """{equipment id: equipment} of the whole collection, the pages are fetched in parallel."""
+    _, pages = api_list(f"{BASE_URL}/equipment", JWT_TOKEN, params={"fields": ",".join(EQUIPMENT_FIELDS)}, limit=100)
+    return {item['id']: item for records in pages for item in records}
 
 # Function to get files for a specific equipment item
 def get_equipment_files(equipment_id):
     url = f"{BASE_URL}/equipment/{equipment_id}/files"
-    headers = {
-        'Authorization': f"Bearer {JWT_TOKEN}"
+    return api_get_json(url, JWT_TOKEN).get('data', [])
+
+def equipment_files_pages(equipment):
+    """
+    Returns (number of files, pages): the files of all equipment, one list at a time.
+    Paging through /files needs a few calls for the whole collection instead of one call per equipment.
+    """
+    if(args.per_item):
+        executor = ThreadPoolExecutor(max_workers=max(1, args.workers))
+        return None, executor.map(get_equipment_files, equipment)
+    return api_list(f"{BASE_URL}/files", JWT_TOKEN, params={"itemtype": "Materiaal"}, limit=100)
+
+def head_file(url):
+    """Content-Length and ETag of the amazonS3 object, or the HTTP status / error if it could not be read."""
+    if 'rentman-tempstorage' in url:
+        return {'head_error': 'temporary storage'}  # labels.pdf and the like, not loadable
+    try:
+        response = file_head(url)
+    except requests.exceptions.RequestException as e:
+        return {'head_error': str(e)}
+    with response:
+        if response.status_code != 200:
+            return {'head_error': f"HTTP {response.status_code}"}
+        length = response.headers.get('Content-Length')
+        return {
+            'content_length': int(length) if length and length.isdigit() else None,
+            'etag': response.headers.get('ETag', '').strip('"') or None,
+            'md5': etag_md5(response),  # None for files uploaded in parts
+        }
+
+def manifest_entry(file, equipment):
+    item = equipment.get(file.get('item'), {})
+    return {
+        'equipment_id': file.get('item'),
+        'equipment_code': item.get('code'),
+        'equipment_name': item.get('name'),
+        'equipment_folder': item.get('folder'),
+        'in_archive': item.get('in_archive'),
+        'file_id': file['id'],
+        'name': file.get('displayname') or file.get('readable_name'),
+        'type': file.get('type'),
+        'size': file.get('size'),
+        'modified': file.get('modified'),
+        'update_hash': file.get('updateHash'),
+        'url': file.get('url'),
     }
-    response = requests.get(url, headers=headers)
-    return response.json()
 
 # Function to update the progress in the console
 def update_progress(current, total):
-    sys.stdout.write('\rCollecting Equipment Files... {}/{}'.format(current, total))
-    sys.stdout.flush()
+    # On stderr, the manifest may be written to stdout
+    sys.stderr.write('\rCollecting Equipment Files... {}/{}'.format(current, total or '?'))
+    sys.stderr.flush()
 
 # Main script
 if __name__ == '__main__':
-    # Fetch all equipment data
-    equipment_data = get_all_equipment()
-    equipment_items = equipment_data['data'][:10]  # Adjust this according to the actual response structure
-
-    # Number of equipment items
-    total_items = len(equipment_items)
-    print("Total equipment items to process:", total_items)
+    args = parser.parse_args()
+    JWT_TOKEN = load_jwt_token('JWT_TOKEN')
+    if not JWT_TOKEN:
+        sys.exit(1)
 
-    # Iterate through equipment and fetch files
-    all_equipment_files = {}
-    last_request_time = time.time()
+    started = time.monotonic()
+    equipment = get_all_equipment()
+    print(f"Total equipment items: {len(equipment)}", file=sys.stderr)
+    total_files, pages = equipment_files_pages(equipment)
 
-    for index, item in enumerate(equipment_items, start=1):
-        equipment_id = item['id']  # Adjust this according to the actual response key for equipment ID
-        update_progress(index, total_items)  # Update the progress before the API call
-
-        # Ensure that at least 0.66 seconds have passed since the last request
-        # Max of 20 req./s
-        current_time = time.time()
-        elapsed = current_time - last_request_time
-        if elapsed < 0.066:
-            time.sleep(0.066- elapsed)
-        
-        files_data = get_equipment_files(equipment_id)
-        last_request_time = time.time()
-        ## file_urls = [file['url'] for file in files_data['data'] if 'rentman-tempstorage' not in file['url']]  # Filter out deleted images
-        file_urls = [file for file in files_data['data']]
-        
-        # Exclude file URLs that contain 'rentman-tempstorage'
-        # Those are labels.pdf and are not loadable
-        all_equipment_files[equipment_id] = file_urls
+    num_files = 0
+    total_size = 0
+    head_executor = ThreadPoolExecutor(max_workers=max(1, args.head_workers)) if args.head else None
+    manifest = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for files in pages:
+            entries = [manifest_entry(file, equipment) for file in files]
+            if(head_executor):
+                for entry, head in zip(entries, head_executor.map(head_file, [entry['url'] or '' for entry in entries])):
+                    entry.update(head)
+            for entry in entries:
+                manifest.write(json.dumps(entry) + '\n')
+                total_size += entry.get('content_length') or entry['size'] or 0
+            manifest.flush()  # Lines can be read while the inventory is running
+            num_files += len(entries)
+            update_progress(num_files, total_files)
+    finally:
+        if manifest is not sys.stdout:
+            manifest.close()
+        if(head_executor):
+            head_executor.shutdown()
 
     # Finish progress
-    sys.stdout.write('\n')
-    sys.stdout.flush()
-
-    # Save all equipment and file URLs to a JSON file
-    with open('collectAllEquipmentPhotoUrls.json', 'w') as f:
-        json.dump(all_equipment_files, f, indent=4)
-
-    print("All equipment and associated file URLs have been saved to 'collectAllEquipmentPhotoUrls.json'")
+    sys.stderr.write('\n')
+    print(f"{num_files} files of {len(equipment)} equipment, {total_size / 1024 ** 3:.2f} GB, in {time.monotonic() - started:.1f}s"
+          + (f", written to '{args.output}'" if args.output != '-' else ""), file=sys.stderr)
+    if(args.output != '-'):
+        print_request_stats()
@@ -2,22 +2,31 @@ import requests
 import argparse
 import json
 import time
+import datetime
 import sys
 import os
-import contextlib
+import shutil
 import urllib.parse  # For handling URL to filename conversion
 from urllib.parse import quote
-import subprocess
-import qrcode
-import qrcode.image.svg
-import pypandoc
-import datetime
-import shutil
-from weasyprint import HTML
+import threading
+import cProfile
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from rentmanApi import BASE_URL, api_get_json, api_get_pages, api_list, endpoint_stats
+from exportState import ExportState, MAX_EXPORT_ATTEMPTS
+from fileDownloads import download_to_file
+from blobCache import BlobCache, link_or_copy
+from itemStaging import staging_path, reset_staging, carry_over_files, commit_folder, move_folder, remove_folder, empty_trash
+from qrCache import get_qr_codes
+from catalog import Catalog
+from imageDerivatives import evict_derivatives
+from publishExport import PUBLISH_FORMATS, publish_export, print_publish_stats
+import runMetrics
+from runMetrics import timed, measure_item, run_measured, merge_snapshot
+from renderItem import RENDER_OPTIONS, RENDER_OUTPUTS, extra_input_fields, load_file_content, render_item, render_items_batch, missing_outputs, with_required_outputs
 
 
-# Constants for the API endpoints
-BASE_URL = 'https://api.rentman.net'
 JWT_TOKEN = ''  # Create a file called "JWT_TOKEN" (without file extension), put the JWT token there, it will be read by this script and inserted.
 
 # Only export first n of your equipment collection.
@@ -33,6 +42,23 @@ parser.add_argument('--num', type=int, help='Number of objects to export', defau
 parser.add_argument('--id', type=str, help='Comma-separated list of specific equipment IDs to export', default="")  
 parser.add_argument('--verbose', action='store_true', help='Print all the details of the export')
 parser.add_argument('--overwrite', action='store_true', help='Overwrite existing files')
+parser.add_argument('--render-only', action='store_true', help='No download: create md, PDFs, QR codes and sheets again from the data.json files in equipmentDump')
+parser.add_argument('--sheet-batch', type=int, help='With --render-only: lay out the sheets of N articles in one document (faster than one by one)', default=0)
+parser.add_argument('--cache-size', type=float, help='Max. size of the download cache in GB', default=20)
+parser.add_argument('--workers', type=int, help='Number of equipment items exported at the same time', default=1)
+parser.add_argument('--pdf-engine', choices=['pandoc', 'weasyprint'], help='Converter for data.md to PDF: pandoc (needs LaTeX) or weasyprint (in-process, faster)', default='pandoc')
+parser.add_argument('--original-images', action='store_true', help='Use the original images in the PDFs instead of downscaled copies')
+parser.add_argument('--no-compress', action='store_true', help='Skip the Ghostscript pass over the sheet PDFs')
+parser.add_argument('--keep-deleted', action='store_true', help='Keep the folders of equipment that was deleted in rentman')
+parser.add_argument('--metrics', type=str, help='Write the timings and counters of the run to this file (JSON, or Prometheus text format if it ends with .prom)', default=None)
+parser.add_argument('--profile', type=str, help='Write a cProfile dump of the main process to this file (view with: python3 -m pstats FILE)', default=None)
+parser.add_argument('--watch', action='store_true', help='Keep running: export everything once, then every --interval seconds only the equipment that changed in rentman')
+parser.add_argument('--interval', type=float, help='With --watch: seconds between two checks for changes', default=60)
+parser.add_argument('--full-interval', type=float, help='With --watch: seconds between two complete exports (to notice deleted equipment)', default=3600)
+parser.add_argument('--outputs', type=str, help='Comma-separated outputs to make: json,files,md,pdf,qr,sheet (default: all; data.json is always written)', default=','.join(('json', 'files') + RENDER_OUTPUTS))
+parser.add_argument('--publish', type=str, help='After the export, update this folder (eg. in Dropbox) with the PDFs and images, see publishExport.py', default=None)
+parser.add_argument('--publish-format', choices=PUBLISH_FORMATS, help='With --publish: tree (links to the files) or one zip/tar archive per category', default='tree')
+parser.add_argument('--render-workers', type=int, help='Number of processes creating the PDFs (default: number of CPU cores, 0: no separate processes)', default=os.cpu_count())
 
 # Parse the arguments
 args = parser.parse_args()
@@ -41,30 +67,39 @@ args = parser.parse_args()
 start_index = args.start
 num_obj_to_export = args.num
 specific_obj_export = [int(i) for i in args.id.split(',')] if args.id else []
-overwrite = args.overwrite  # Re-Download, encode etc if file data.json exists
+overwrite = args.overwrite  # Re-Download, encode etc even if the equipment did not change since the last export
 verbose = args.verbose
+workers = max(1, args.workers)
+render_workers = max(0, args.render_workers or 0)
+sheet_batch = args.sheet_batch
+# Stages to run: 'json' (data.json, always), 'files' (downloads) and the outputs of the render stage.
+# Renderers of outputs that are not wanted are never imported.
+outputs = with_required_outputs(output.strip() for output in args.outputs.split(',') if output.strip()) | {'json'}
+if not outputs <= set(('json', 'files') + RENDER_OUTPUTS):
+    parser.error(f"unknown --outputs: {', '.join(sorted(outputs - set(('json', 'files') + RENDER_OUTPUTS)))}")
+render_options = dict(RENDER_OPTIONS, verbose=verbose, pdf_engine=args.pdf_engine,
+                      image_derivatives=not args.original_images, compress=not args.no_compress,
+                      outputs=tuple(output for output in RENDER_OUTPUTS if output in outputs))
+if not render_options['outputs']:
+    render_workers = 0  # Nothing to render, no processes needed
 
 num_obj_exported = 0
+progress_lock = threading.Lock()
+num_obj_done = 0
+# "modified" dates of the items of this export_equipment() call that were not committed (for --watch)
+failed_items = []
+
+# Render stage: md, PDFs, QR codes and sheets are made in a process pool while the next items are fetched.
+# At most this many items wait for rendering; fetching pauses when the render stage falls behind.
+render_queue_size = 2 * max(1, render_workers)
+render_pool = None
+render_pool_lock = threading.Lock()
+render_slots = threading.BoundedSemaphore(render_queue_size)
+# The render processes are started on the first submit, while the fetch threads hold locks (eg. the one
+# of runMetrics). A forked copy of such a lock stays locked forever in the child, so they are started
+# by a fork server (or spawned) instead of being forked from this process.
+render_context = multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn')
 
-# Caveat: "Custom fields are not queryable." (https://api.rentman.net/#section/Introduction/Custom-fields)
-extra_input_fields = {
-    "custom_1": "Artikelbeschreibung in Englisch",
-    "custom_4": "Bemerkung an Mieter\\*in",
-    "custom_7": "Baujahr",
-    "custom_8": "Kategorie"
-}
-
-def load_file_content(file_path):
-    try:
-        with open(file_path, 'r') as file:
-            return file.read().strip()  # Read the token and strip any extra whitespace
-    except FileNotFoundError:
-        print(f"The file '{file_path}' was not found.")
-        return None
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        return None
-    
 def safe_filename(url):
     """Create a safe filename from a NAME by replacing spaces, slashes, and other special characters with underscores."""
     # Extract the file name from the URL
@@ -106,154 +141,139 @@ def revert_to_original_filename(safed_filename):
 
 # Function to get all equipment data with pagination
 def get_all_equipment():
-    equipment_data = []
+    """
+    Returns (number of articles, articles). The articles are a generator that yields every
+    page as soon as it arrives, so the export starts before the whole list is fetched.
+    """
     limit = 100  # Maximum number of records per request
-    offset = 0   # Start at the first record
-    
-    headers = {
-        'Authorization': f"Bearer {JWT_TOKEN}"
-    }
-    
-    while True:
-        # Define the request URL with limit and offset
-        print(f"  {int(offset/limit+1)}. API call to '{BASE_URL}/equipment?limit={limit}&offset={offset}'")
-        url = f"{BASE_URL}/equipment?limit={limit}&offset={offset}"
-        response = requests.get(url, headers=headers)
-        data = response.json()
-
-        # Check for errors in response
-        if response.status_code != 200:
-            print(f"Error: {response.status_code}: {data.get('errorMessage', 'Unknown error')}")
-            break
-        
-        # Add the retrieved data to the list
-        equipment_data.extend(data.get('data', []))
-
-        # Check if there are more records to fetch
-        if len(data.get('data', [])) < limit:
-            break  # No more records to fetch, exit the loop
+    # Raises after all retries failed - an incomplete list must not look like the whole DB
+    with timed('list'):
+        total, pages = api_list(f"{BASE_URL}/equipment", JWT_TOKEN, limit=limit)
+
+    def equipment_items():
+        page = 0
+        while True:
+            with timed('list'):  # Time spent waiting for the next page
+                records = next(pages, None)
+            if records is None:
+                return
+            page += 1
+            if(verbose):
+                print(f"\n  {page}. page of '{BASE_URL}/equipment?limit={limit}' received ({len(records)} articles)")
+            yield from records
 
-        # Increase the offset for the next request
-        offset += limit
-
-    return equipment_data
+    if total is None:
+        # The API did not tell how many there are; needed for the progress, so fetch everything first
+        equipment_data = list(equipment_items())
+        return len(equipment_data), iter(equipment_data)
+    return total, equipment_items()
 
 # Function to get specific equipment
 def get_equipment(equipment_id):
     url = f"{BASE_URL}/equipment/{equipment_id}"
-    headers = {
-        'Authorization': f"Bearer {JWT_TOKEN}"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json()
+    with timed('detail'):
+        return api_get_json(url, JWT_TOKEN)
 
 # Function to get files for a specific equipment item
 def get_equipment_files(equipment_id):
     url = f"{BASE_URL}/equipment/{equipment_id}/files"
-    headers = {
-        'Authorization': f"Bearer {JWT_TOKEN}"
-    }
-    response = requests.get(url, headers=headers)
-    return response.json()
+    with timed('files'):
+        return api_get_json(url, JWT_TOKEN)
 
 def get_categories():
     # Categories aka folders in rentman system
     url = f"{BASE_URL}/folders"
-    headers = {'Authorization': f"Bearer {JWT_TOKEN}"}
-    response = requests.get(url, headers=headers)
-    folders = response.json()
+    folders = api_get_json(url, JWT_TOKEN)
     return {folder['id']: folder for folder in folders['data']}
 
-# Function to download file
-def download_file(url, folder_path):
-    filename = safe_filename(url)
-    response = requests.get(url)
-    if response.status_code == 200:
-        file_path = os.path.join(folder_path, filename)
-        with open(file_path, 'wb') as f:
-            f.write(response.content)
-        return filename  # Return the filename for inclusion in JSON and Markdown files
-    return None  # In case of download failure
+def get_categories_of(items):
+    # Only the categories of the given equipment, one /folders/{id} call each
+    folder_ids = {int(os.path.basename(item['folder'])) for item in items if item.get('folder')}
+    return {folder_id: api_get_json(f"{BASE_URL}/folders/{folder_id}", JWT_TOKEN)['data'] for folder_id in sorted(folder_ids)}
 
-def convert_md_to_pdf(md_file_path, output_pdf_path, resource_path):
-    try:
-        # Convert markdown to PDF using Pandoc
-        pypandoc.convert_file(md_file_path, 'pdf', outputfile=output_pdf_path, extra_args=(["-V", "papersize:a4", "-V", "geometry:margin=1.5cm", f"--resource-path={resource_path}", "--embed-resources", "--standalone"]))
-    except Exception as e:
-        print("\nAn error occurred while generating PDF; skipping:", e)
-
-def generate_qr_code(qr_path, number):
-    """
-    Generates a QR code SVG image for the provided number.
+def get_equipment_by_codes(codes):
+    """Equipment with the given "code"s, filtered by the API instead of listing everything."""
+    equipment_data = []
+    for code in codes:
+        records = api_get_json(f"{BASE_URL}/equipment", JWT_TOKEN, params={"code": code}).get('data', [])
+        # Double check, in case the API ignores the filter
+        equipment_data.extend(record for record in records if str(record.get('code')) == str(code))
+    return equipment_data
 
-    Args:
-    qr_path (str): The file path where the QR code SVG will be saved.
-    number (str): The number to encode in the QR code.
+def get_equipment_range(start, num):
+    """num equipment starting at index start, fetched with limit/offset instead of listing everything."""
+    equipment_data = []
+    limit = 100  # Maximum number of records per request
+    while len(equipment_data) < num:
+        page_limit = min(limit, num - len(equipment_data))
+        records = api_get_json(f"{BASE_URL}/equipment", JWT_TOKEN, params={"limit": page_limit, "offset": start + len(equipment_data)}).get('data', [])
+        equipment_data.extend(records)
+        if len(records) < page_limit:
+            break  # End of the collection
+    return equipment_data
 
-    Returns:
-    None. Saves the QR code image as an SVG file.
+# Fields joined from the /equipment/{id} call that are missing in the /equipment list
+QUANTITY_FIELDS = ("current_quantity_excl_cases", "current_quantity", "quantity_in_cases")
+
+# Below this many exported equipment, one call per equipment is cheaper than paging through everything
+BULK_LOOKUP_AFTER = 10
+
+# Lookups built with a few paginated calls instead of 2 calls per equipment; filled on first use
+bulk_lock = threading.Lock()
+bulk_lookups_requested = 0
+files_by_equipment = None       # {equipment id: [file, file, ..]}
+quantities_by_equipment = None  # {equipment id: {"current_quantity": .., ..}}
+
+def get_all_equipment_files():
+    """All files attached to equipment ("itemtype": "Materiaal"), grouped by equipment id."""
+    files_index = {}
+    for records in api_get_pages(f"{BASE_URL}/files", JWT_TOKEN, params={"itemtype": "Materiaal"}):
+        for file in records:
+            files_index.setdefault(file.get('item'), []).append(file)
+    for files in files_index.values():
+        files.sort(key=lambda file: file['id'])
+    return files_index
+
+def get_all_equipment_quantities():
     """
-    # Set the factory to create an SVG image
-    svg_factory = qrcode.image.svg.SvgPathImage
-
-    # Create a QRCode object with SVG support
-    qr = qrcode.QRCode(
-        version=1,  # Controls the size of the QR Code
-        error_correction=qrcode.constants.ERROR_CORRECT_H,  # High error correction level
-        box_size=10,
-        border=4,
-        image_factory=svg_factory
-    )
-
-    # Add data to the QR Code
-    qr.add_data(number)
-    qr.make(fit=True)
-
-    # Create an SVG image from the QR Code instance
-    img = qr.make_image(fill_color="black", back_color="white")
-
-    # Save the SVG image to the specified path
-    img.save(qr_path)
-    #print(f"QR code generated and saved at '{qr_path}'.")
-
-def convert_html_to_pdf(html_path, pdf_path_sheet):
-    try:
-        # Make weasyprint silent (subpress all warnings)
-        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
-            # weasyprint
-            # Convert HTML to PDF using WeasyPrint
-            HTML(html_path).write_pdf(pdf_path_sheet)
-    except Exception as e:
-        print(f"      An error occurred: {e}")
-
-
-def compress_pdf(input_path, quality="screen"):
+    Quantities of all equipment via field selection on the /equipment list.
+    Equipment for which the API does not deliver the fields is left out and falls back to get_equipment().
     """
-    Compress PDF via Ghostscript.
-    quality: one of 'screen', 'ebook', 'printer', 'prepress', 'default'
+    quantities = {}
+    params = {"fields": ",".join(("id",) + QUANTITY_FIELDS)}
+    for records in api_get_pages(f"{BASE_URL}/equipment", JWT_TOKEN, params=params):
+        for record in records:
+            if all(field in record for field in QUANTITY_FIELDS):
+                quantities[record['id']] = {field: record[field] for field in QUANTITY_FIELDS}
+    return quantities
+
+def use_bulk_lookups():
     """
-    output_path = input_path + ".tmp.pdf"
-    command = [
-        "gs",
-        "-sDEVICE=pdfwrite",
-        "-dCompatibilityLevel=1.4",
-        f"-dPDFSETTINGS=/{quality}",
-        "-dNOPAUSE",
-        "-dQUIET",
-        "-dBATCH",
-        f"-sOutputFile={output_path}",
-        input_path,
-    ]
+    True once enough equipment is exported in this run that paging through /files and /equipment
+    once is cheaper than calling /equipment/{id} and /equipment/{id}/files for every item.
+    Builds both lookups on the first call that returns True (other workers wait for it).
+    """
+    global bulk_lookups_requested, files_by_equipment, quantities_by_equipment
+    with bulk_lock:
+        if files_by_equipment is None:
+            bulk_lookups_requested += 1
+            if bulk_lookups_requested <= BULK_LOOKUP_AFTER:
+                return False
+            with timed('bulk lookups'):
+                files_by_equipment = get_all_equipment_files() if 'files' in outputs else {}
+                quantities_by_equipment = get_all_equipment_quantities()
+        return True
 
-    try:
-        subprocess.run(command, check=True)
-        os.remove(input_path)
-        os.rename(output_path, input_path)
-    except subprocess.CalledProcessError as e:
-        print(f"An error occurred while compressing the PDF (gs): {e}")
-        if os.path.exists(output_path):
-            os.remove(output_path)
-   
+# Function to download file
+def download_file(url, folder_path, expected_size=None):
+    # Files are stored on amazonS3, not on api.rentman.net - not rate limited
+    filename = safe_filename(url)
+    file_path = os.path.join(folder_path, filename)
+    with timed('download'):
+        downloaded = download_to_file(url, file_path, expected_size)
+    if downloaded:
+        return filename  # Return the filename for inclusion in JSON and Markdown files
+    return None  # In case of download failure
 
 # Function to update the progress in the console
 def update_progress(current, total, files_download, filename):
@@ -276,275 +296,698 @@ def update_progress(current, total, files_download, filename):
     sys.stdout.write(progress_message + "\033[K")
     sys.stdout.flush()
 
-# Main script
-if __name__ == '__main__':
-    JWT_TOKEN = load_file_content('JWT_TOKEN')
-
-    if(num_obj_to_export > 0):
-        print(f"Limit export of {num_obj_to_export} equipment. Change in the code to any other integer or to 0 if you want to export everything.\n")
-    elif(specific_obj_export):
-        print(f"Fetch {len(specific_obj_export)} object(s) with code(s) {specific_obj_export}\n")
+def submit_render(item, staging_folder, folder_path, eq_name, files_list):
+    """
+    Hand an item over to the render stage. It is rendered in its staging folder and only
+    committed to folder_path once everything is rendered, so an item whose rendering failed
+    is never skipped as exported; the next run renders it again from its staging folder.
+    """
+    if render_pool is None:
+        render_in_process(item, staging_folder, folder_path, eq_name, files_list)
+        return
+    render_slots.acquire()  # Blocks while the queue of the render stage is full
+    for attempt in range(2):
+        pool = render_pool
+        try:
+            # The render process measures its stages and sends the timings back with the result
+            future = pool.submit(run_measured, item['code'], render_item, item, staging_folder, eq_name, files_list, render_options, exported_folder=folder_path)
+            break
+        except BrokenProcessPool:
+            replace_render_pool(pool)
     else:
-        print(f"Reading database, export everything.\n")
-
-    root_folder = 'equipmentDump'
-    os.makedirs(root_folder, exist_ok=True)  # Create root directory
-
-    categories = get_categories()  # Retrieve all folders (aka categories)
-    equipment_data = get_all_equipment()
-    print(f"Found {len(equipment_data)} articles in DB.")
-    print(f"-------------------------------")
+        # The new render processes died as well: render here, the slot is not used
+        render_slots.release()
+        render_in_process(item, staging_folder, folder_path, eq_name, files_list)
+        return
+    future.add_done_callback(lambda future: render_done(future, pool, item, staging_folder, folder_path, eq_name, files_list))
+
+def render_in_process(item, staging_folder, folder_path, eq_name, files_list):
+    if render_options['outputs']:
+        with measure_item(item['code']):
+            render_item(item, staging_folder, eq_name, files_list, render_options, exported_folder=folder_path)
+    commit_item(item, staging_folder, folder_path, eq_name, files_list)
+
+def replace_render_pool(broken_pool):
+    """
+    A render process died (eg. killed when out of memory while rendering a PDF): its pool takes no
+    more work and fails all items it was rendering. Start new render processes for the next items.
+    """
+    global render_pool
+    with render_pool_lock:
+        if render_pool is broken_pool:
+            print(f"\n   ⚠️  A render process died, starting new render processes")
+            render_pool = ProcessPoolExecutor(max_workers=render_workers, mp_context=render_context)
 
-    # equipment_items = equipment_data['data']
-    if(num_obj_to_export > 0):
-        # Limit to first n equipment items for testing
-        #equipment_items = equipment_data['data'][:num_obj_to_export]
-        equipment_items = equipment_data[start_index:start_index + num_obj_to_export]
-    else:
-        equipment_items = equipment_data
+def render_done(future, pool, item, staging_folder, folder_path, eq_name, files_list):
+    try:
+        _, render_metrics = future.result()
+        merge_snapshot(render_metrics)
+        commit_item(item, staging_folder, folder_path, eq_name, files_list)
+    except Exception as e:
+        # Stays in its staging folder ('downloaded'), the next run or check renders it again
+        print(f"\n   Rendering of '{item['code']}' failed: {e}")
+        item_failed(item)
+        if isinstance(e, BrokenProcessPool):
+            replace_render_pool(pool)
+    finally:
+        render_slots.release()  # Only now, so wait_for_renders() also waits for the commit
+
+def item_failed(item):
+    with progress_lock:
+        failed_items.append(item.get('modified'))
+
+def wait_for_renders():
+    """Wait until every submitted item is rendered and committed, the render pool keeps running."""
+    for _ in range(render_queue_size):
+        render_slots.acquire()
+    for _ in range(render_queue_size):
+        render_slots.release()
+
+def commit_item(item, staging_folder, folder_path, eq_name, files_list):
+    """Replace the folder of the item by its completely built staging folder."""
+    # Committed even if rendering failed (eg. LaTeX cannot embed an image) or a download failed,
+    # with what is missing recorded, so it is exported again
+    failed_downloads = (read_export(staging_folder) or {}).get('failed_downloads', [])
+    render_missing = missing_outputs(staging_folder, eq_name, render_options['outputs'])
+    missing = (['files'] if failed_downloads else []) + render_missing
+    export_state.record_stage(item, 'rendered', staging_folder, folder_path)
+    previous = read_export(folder_path)
+    try:
+        with measure_item(item['code']), timed('commit'):
+            if previous:
+                # Files of the previous export that are not in the new one were removed or renamed in rentman.
+                # Outputs not made in this run (--outputs) are kept, unless they carry the previous name.
+                previous_eq_name = item_folder_name(previous['equipment_data'])
+                kept_outputs = [output for output in RENDER_OUTPUTS if output not in render_options['outputs']] if previous_eq_name == eq_name else []
+                carry_over_files(folder_path, staging_folder, {file['filename'] for file in previous['files']},
+                                 previous_eq_name, kept_outputs)
+            else:
+                carry_over_files(folder_path, staging_folder)
+            commit_folder(staging_folder, folder_path, root_folder)
+    except OSError as e:
+        print(f"\n   Could not move '{item['code']}' to {folder_path}: {e}")
+        item_failed(item)
+        return
+    # Remember what was exported; unchanged equipment is skipped next time
+    render_attempts = export_state.record_equipment(item, folder_path, files_list, outputs, missing)
+    export_state.clear_stages(item['id'])
+    if(missing):
+        if render_attempts < MAX_EXPORT_ATTEMPTS:
+            retry = f"it is exported again next run ({render_attempts} of {MAX_EXPORT_ATTEMPTS} attempts)"
+            item_failed(item)  # --watch: checked again in the next round
+        else:
+            retry = "not exported again until it changes in rentman (or --overwrite)"
+        reasons = []
+        if(failed_downloads):
+            reasons.append(f"{len(failed_downloads)} file(s) that could not be downloaded")
+        if(render_missing):
+            reasons.append(f"{', '.join(render_missing)} (rendering failed)")
+        print(f"\n   ⚠️  '{item['code']}' exported without {' and '.join(reasons)}, {retry}")
+    catalog.update_item(item, os.path.relpath(folder_path, root_folder), files_list, extra_input_fields)
+
+def read_export(folder_path):
+    """The data.json of an exported equipment ({'equipment_data': .., 'files': [..]}), or None."""
+    try:
+        with open(os.path.join(folder_path, 'data.json'), 'r') as f:
+            data = json.load(f)
+    except (ValueError, OSError):
+        return None
+    return data if 'equipment_data' in data else None
 
-    last_request_time = time.time()  # Initialize the last request time
+def item_folder_name(item):
+    """Name of the folder of an equipment, also the first part of its PDF, sheet and QR code files."""
+    return f"{item['code']}_{item['qrcodes']}_{safe_filename(item.get('name', 'Unknown'))}"
 
-    print(f"Collecting equipment data and creating files…")
+def collected_sheet_path(eq_name):
+    return os.path.join("equipmentSheets", f"{eq_name}-sheet.pdf")
 
-    for index, item in enumerate(equipment_items, start=1):
-        equipment_name = safe_filename(item.get('name', 'Unknown'))
-        equipment_id = item['id']
+def move_exported_item(item, folder_path):
+    """
+    If the equipment was exported to another folder (category renamed or moved, name changed,
+    archived), rename that folder to folder_path instead of exporting everything again.
+    Returns the data.json of the moved export, or None if nothing was moved.
+    """
+    old_folder_path = export_state.exported_folder(item['id'])
+    if(not old_folder_path or old_folder_path == folder_path or not os.path.isdir(old_folder_path) or os.path.exists(folder_path)):
+        return None
+    try:
+        move_folder(old_folder_path, folder_path, root_folder)
+    except OSError as e:
+        print(f"\n   Could not move '{old_folder_path}' to '{folder_path}': {e}")
+        return None
+    export_state.move_equipment(item['id'], folder_path)
+    if(verbose):
+        print(f"   Moved from '{old_folder_path}'")
+    old_eq_name = os.path.basename(old_folder_path)
+    if(old_eq_name != os.path.basename(folder_path) or item.get('in_archive')):
+        # Renamed or archived: the copy in equipmentSheets is outdated
+        if os.path.isfile(collected_sheet_path(old_eq_name)):
+            os.remove(collected_sheet_path(old_eq_name))
+    return read_export(folder_path)
+
+def rerender_moved_item(item, folder_path, eq_name, exported):
+    """
+    Render an unchanged equipment again whose category path (shown in its PDF and sheet) changed.
+    Its files are linked into the staging folder, nothing is downloaded.
+    Returns False if the files are not complete, then the equipment has to be exported again.
+    """
+    staging_folder = staging_path(root_folder, item['id'])
+    shutil.rmtree(staging_folder, ignore_errors=True)
+    os.makedirs(staging_folder)
+    staged_item = dict(exported['equipment_data'], folder_path=item['folder_path'])
+    try:
+        for file in exported['files']:
+            link_or_copy(os.path.join(folder_path, file['local_path']), os.path.join(staging_folder, file['local_path']))
+    except OSError:
+        return False
+    with open(os.path.join(staging_folder, 'data.json'), 'w') as f:
+        json.dump({'equipment_data': staged_item, 'files': exported['files']}, f, indent=4)
+    export_state.record_stage(staged_item, 'downloaded', staging_folder, folder_path)
+    submit_render(staged_item, staging_folder, folder_path, eq_name, exported['files'])
+    return True
+
+def keep_exported_files(folder_path, staging_folder):
+    """Link the files of the previous export into the staging folder. Returns their entries of data.json."""
+    exported = read_export(folder_path)
+    kept_files = []
+    for file in (exported['files'] if exported else []):
+        try:
+            link_or_copy(os.path.join(folder_path, file['local_path']), os.path.join(staging_folder, file['local_path']))
+        except OSError:
+            continue  # Not in the folder anymore
+        kept_files.append(file)
+    return kept_files
+
+def prune_deleted_items(seen_ids):
+    """Remove the folders of exported equipment that is not in rentman anymore."""
+    num_pruned = 0
+    for equipment_id, folder_path in export_state.exported_folders().items():
+        if equipment_id in seen_ids:
+            continue
+        print(f"Removing '{folder_path}', it was deleted in rentman")
+        remove_folder(folder_path, root_folder)
+        if folder_path and os.path.isfile(collected_sheet_path(os.path.basename(folder_path))):
+            os.remove(collected_sheet_path(os.path.basename(folder_path)))
+        shutil.rmtree(staging_path(root_folder, equipment_id), ignore_errors=True)
+        catalog.remove_item(equipment_id)
+        export_state.forget_equipment(equipment_id)
+        num_pruned += 1
+    return num_pruned
+
+def report_progress(index, total, files_download, filename):
+    """
+    Thread safe wrapper around update_progress. With several workers the items finish
+    in random order, so count the finished items instead of using the list index.
+    """
+    global num_obj_done
+    with progress_lock:
+        num_obj_done += 1
+        update_progress(index if workers == 1 else num_obj_done, total, files_download, filename)
 
-        # if(specific_obj_export > 0 and int(item['code']) != specific_obj_export):
-        if specific_obj_export and int(item['code']) not in specific_obj_export:
-            # Skip if it's not in the list
-            # print(f"{specific_obj_export} is not {item['code']}")
-            continue  # Skip to the next iteration
-        
-        num_obj_exported += 1
+def export_item(index, item, total):
+    """
+    Collect all data and files of one equipment item and create the md, PDF, QR codes and sheet.
+    Runs in a worker thread when --workers is bigger than 1.
+    """
+    equipment_name = safe_filename(item.get('name', 'Unknown'))
+    equipment_id = item['id']
 
+    if(verbose):
+        #print(f"\nCollecting {index}/{total}: '{equipment_id} - {equipment_name}'")
+        if(num_obj_to_export>0):
+            tot_export = start_index+num_obj_to_export
+        else:
+            tot_export = total
+        print(f"\nCollecting {start_index+index}/{tot_export}: '{equipment_id} - {equipment_name}'")
+
+    category_path = item.get('folder', None)  # eg.  "folder": "/folders/55"
+    # Add human readable key/value to item - ATTENTION: This is *not* according to specs of rentman
+    # in equipment:
+    #   "folder": "/folders/55"
+    # in categories:
+    #   55: {'id': 55, 'created': '2023-12-09T20: 07: 09+01: 00', 'modified': '2024-02-11T13: 19: 59+01: 00', 'creator': '/crew/33', 'displayname': 'Sideboards', 'parent': '/folders/50', 'name': 'Sideboards', 'order': 10, 'itemtype': 'equipment', 'path': 'MÖBEL & GROSSREQUISITEN/Sideboards', 'updateHash': '84bba838972ede16a4c8ce4ea286d3bc'
+
+    if(category_path):
+        category_path = os.path.basename(category_path)  # eg. 55
+        category_path_human_readable = categories[int(category_path)]["path"]  # Find human readable path in categories
+        item["folder_path"] = category_path_human_readable
         if(verbose):
-            #print(f"\nCollecting {index}/{len(equipment_items)}: '{equipment_id} - {equipment_name}'")
-            if(num_obj_to_export>0):
-                tot_export = start_index+num_obj_to_export
-            else:
-                tot_export = len(equipment_items)
-            print(f"\nCollecting {start_index+index}/{tot_export}: '{equipment_id} - {equipment_name}'")
-
-        category_path = item.get('folder', None)  # eg.  "folder": "/folders/55"
-        # Add human readable key/value to item - ATTENTION: This is *not* according to specs of rentman
-        # in equipment:
-        #   "folder": "/folders/55"
-        # in categories:
-        #   55: {'id': 55, 'created': '2023-12-09T20: 07: 09+01: 00', 'modified': '2024-02-11T13: 19: 59+01: 00', 'creator': '/crew/33', 'displayname': 'Sideboards', 'parent': '/folders/50', 'name': 'Sideboards', 'order': 10, 'itemtype': 'equipment', 'path': 'MÖBEL & GROSSREQUISITEN/Sideboards', 'updateHash': '84bba838972ede16a4c8ce4ea286d3bc'
-
-        if(category_path):
-            category_path = os.path.basename(category_path)  # eg. 55
-            category_path_human_readable = categories[int(category_path)]["path"]  # Find human readable path in categories
-            item["folder_path"] = category_path_human_readable
+            print(f"   Joining additional data from /folders/{{id}} call: {category_path_human_readable}")
+    else:
+        item["folder_path"] = "."
+
+    #folder_name = f"{item['code']}_{item['qrcodes']}_{equipment_name}"
+    ###folder_name = os.path.join(make_path_url_compatible(item["folder_path"]), f"{item['code']}_{item['qrcodes']}_{make_path_url_compatible(equipment_name)}")
+    eq_name = item_folder_name(item)
+    folder_name = os.path.join(item["folder_path"], eq_name)
+    #'/'.join(quote(folder_name) for folder_name in folder_name.split('/'))
+    #  TODO: make parts of item["folder_path"] url-friendly
+    # folder_name = "".join(c for c in folder_name if c.isalnum() or c in (' ', '.', '_', '-')).rstrip()
+
+    folder_path = os.path.join(root_folder, folder_name)
+    if(item.get('in_archive')):
+        folder_path = os.path.join(root_folder, "_archived", folder_name)
+
+    # Exported to another folder before: rename that folder, its files are not downloaded again
+    moved_export = move_exported_item(item, folder_path)
+
+    if(not overwrite and not export_state.equipment_changed(item, folder_path, outputs)):
+        category_changed = moved_export and moved_export['equipment_data'].get('folder_path') != item['folder_path']
+        # Only the category changed: it is shown in the PDF and sheet, so render them again
+        if(category_changed and rerender_moved_item(item, folder_path, eq_name, moved_export)):
             if(verbose):
-                print(f"   Joining additional data from /folders/{{id}} call: {category_path_human_readable}")
-        else:
-            item["folder_path"] = "."
-
-        #folder_name = f"{item['code']}_{item['qrcodes']}_{equipment_name}"
-        ###folder_name = os.path.join(make_path_url_compatible(item["folder_path"]), f"{item['code']}_{item['qrcodes']}_{make_path_url_compatible(equipment_name)}")
-        eq_name = f"{item['code']}_{item['qrcodes']}_{equipment_name}"
-        folder_name = os.path.join(item["folder_path"], eq_name)
-        #'/'.join(quote(folder_name) for folder_name in folder_name.split('/'))
-        #  TODO: make parts of item["folder_path"] url-friendly
-        # folder_name = "".join(c for c in folder_name if c.isalnum() or c in (' ', '.', '_', '-')).rstrip()
-
-        folder_path = os.path.join(root_folder, folder_name)
-        if(item.get('in_archive')):
-            folder_path = os.path.join(root_folder, "_archived", folder_name)
-        os.makedirs(folder_path, exist_ok=True)
-
-        if(not overwrite and os.path.isfile(os.path.join(folder_path, "data.json"))):
+                print(f"   Category changed - rendering again")
+            report_progress(index, total, 0, equipment_name)
+            return
+        if(not category_changed):
             if(verbose):
-                print(f"   Data already fetched - skipped")
-            update_progress(index, len(equipment_items), 0, equipment_name)
-            continue  # Skip to the next iteration
-
-        # Get additional details that is not delivered by "{BASE_URL}/equipment" call
-        item_details = get_equipment(equipment_id)
-        # item["country_of_origin"] = item_details["data"]["country_of_origin"]  # country_of_origin is not available somehow
-        item["current_quantity_excl_cases"] = item_details["data"]["current_quantity_excl_cases"]
-        item["current_quantity"] = item_details["data"]["current_quantity"]
-        item["quantity_in_cases"] = item_details["data"]["quantity_in_cases"]
+                print(f"   Not changed since last export - skipped")
+            report_progress(index, total, 0, equipment_name)
+            return  # Skip to the next item
+
+    # The item is built in a staging folder and replaces folder_path only when it is complete.
+    # If a previous run stopped while building it, continue with the first unfinished stage.
+    staging_folder = staging_path(root_folder, equipment_id)
+    data_file_path = os.path.join(staging_folder, 'data.json')
+    finished_stage = export_state.finished_stage(item, staging_folder)
+    if(finished_stage):
+        with open(data_file_path, 'r') as f:
+            staged = json.load(f)
         if(verbose):
-            print(f"   Joining additional data from /equipment/{{id}} call:")
-            print(f"      - current_quantity_excl_cases:\t{item['current_quantity_excl_cases']}")
-            print(f"      - current_quantity:\t\t{item['current_quantity']}")
-            print(f"      - quantity_in_cases:\t\t{item['quantity_in_cases']}")
-
-
-        # Save all data to JSON
-        data_file_path = os.path.join(folder_path, 'data.json')
-        with open(data_file_path, 'w') as f:
-            json.dump(item, f, indent=4)
-
-        # Ensure rate limiting before fetching files
-        # Rentman API does not allow more than 20 requests per second
-        current_time = time.time()
-        elapsed = current_time - last_request_time
-        if elapsed < 0.1:
-            time.sleep(0.1 - elapsed)
-        last_request_time = time.time()
-
-        # Download and save file URLs
-        files_data = get_equipment_files(equipment_id)
-        files_list = []
-        for file in files_data['data']:
-            file_url = file.get('url')
-            # TODO: Check if manual added PDF to files on an equipment shows up here or not (because labels are saved here, are PDFs and sum such as well?)
-            if 'rentman-tempstorage' not in file_url:
-                if(verbose):
-                    print(f"   Getting file: {file_url}")
-                filename = download_file(file_url, folder_path)
-                if filename:  # Check if file was successfully downloaded
-                    files_list.append({'filename': filename, 'local_path': filename, 'original_url': file_url, 'data': file})
-
-        # Update JSON with file data
-        with open(data_file_path, 'w') as f:
-            json.dump({'equipment_data': item, 'files': files_list}, f, indent=4)
-        
-        # Update progress
-        if(not verbose):
-            update_progress(index, len(equipment_items), len(files_list), equipment_name)
+            print(f"   Resuming after stage '{finished_stage}' of an earlier run")
+        report_progress(index, total, len(staged['files']), equipment_name)
+        if(finished_stage == 'rendered'):
+            commit_item(staged['equipment_data'], staging_folder, folder_path, eq_name, staged['files'])
         else:
-            print(f"   Created .JSON file: {data_file_path}")
-
-        # Create markdown file with all data
-        md_content = f"[Ça Tourne Requisit](https://www.catourne.ch)\n\n"
-        md_content += f"# {item.get('name', 'Unknown')}"
-        if(item.get('in_archive')):
-            md_content += f" *(Archiviert)*"
-        md_content += "\n\nKategorie: › "
-        category_path_list = f"{item.get('folder_path', 'Unknown').replace('/', ' › ')}\n\n"
-        md_content += category_path_list
-        md_content += "\n\n"
-        md_content += "## Details\n"
-        for key, value in item.items():
-            if(key == "custom"):
-                # Show "EXTRA INPUT FIELDS" in a special way
-                md_content += f"- **Extra Input Fields ('custom')**:\n"
-                for subKey, subValue in value.items():
-                    md_content += f"  - *{extra_input_fields.get(subKey, subKey)}*: {subValue}\n"
+            submit_render(staged['equipment_data'], staging_folder, folder_path, eq_name, staged['files'])
+        return
+    reset_staging(staging_folder)  # Left over from a stopped run or an item that changed since
+
+    # Get additional details that is not delivered by "{BASE_URL}/equipment" call
+    bulk = use_bulk_lookups()
+    if(bulk and equipment_id in quantities_by_equipment):
+        item.update(quantities_by_equipment[equipment_id])
+    else:
+        item_details = get_equipment(equipment_id)
+        # item["country_of_origin"] = item_details["data"]["country_of_origin"]  # country_of_origin is not available somehow
+        for field in QUANTITY_FIELDS:
+            item[field] = item_details["data"][field]
+    if(verbose):
+        print(f"   Joining additional data from {'bulk /equipment?fields=' if bulk else '/equipment/{id}'} call:")
+        print(f"      - current_quantity_excl_cases:\t{item['current_quantity_excl_cases']}")
+        print(f"      - current_quantity:\t\t{item['current_quantity']}")
+        print(f"      - quantity_in_cases:\t\t{item['quantity_in_cases']}")
+
+
+    # Download and save file URLs
+    files_list = []
+    if('files' not in outputs):
+        # --outputs without files: nothing is downloaded, the files of the previous export are kept
+        equipment_files = []
+        files_list = keep_exported_files(folder_path, staging_folder)
+    elif(bulk):
+        equipment_files = files_by_equipment.get(equipment_id, [])
+    else:
+        equipment_files = get_equipment_files(equipment_id)['data']
+    failed_downloads = []  # Urls of files that could not be downloaded (eg. incomplete), tried again next run
+    for file in equipment_files:
+        file_url = file.get('url')
+        # TODO: Check if manual added PDF to files on an equipment shows up here or not (because labels are saved here, are PDFs and sum such as well?)
+        if 'rentman-tempstorage' not in file_url:
+            if(verbose):
+                print(f"   Getting file: {file_url}")
+            file_path = os.path.join(staging_folder, safe_filename(file_url))
+            exported_path = os.path.join(folder_path, safe_filename(file_url))
+            if(not overwrite and export_state.file_unchanged(file, exported_path)):
+                # Same file id and modification date as last export - keep the local copy
+                link_or_copy(exported_path, file_path)
+                filename = safe_filename(file_url)
+            elif(blob_cache.link_from_cache(file, file_path)):
+                # Downloaded before (eg. into another folder) and not changed since
+                filename = safe_filename(file_url)
             else:
-                md_content += f"- **{key}**: {value}\n"
-        md_content += f"\n## Files ({len(files_list)})\n"
-        image_list = []
-        for file in files_list:
-            if(file["data"]["type"].startswith("image/")):
-                image_list.append(file['local_path'])
-                md_content += f"![File](<./{file['local_path']}>)\nLocal Image: [{file['filename']}](<./{file['local_path']}>) | <sub><sup>[*Original URL*]({file['original_url']})</sup></sub><br><br>\n\n\n"
-            elif(file['filename'].endswith('.txt') or file['filename'].endswith('.rtf') or file['filename'].endswith('.TXT') or file['filename'].endswith('.RTF')):
-                file_contents = load_file_content(os.path.join(folder_path, file['filename']))
-                md_content += f"Local File: [{file['filename']}](<./{file['local_path']}>) - Content:\n\n> {file_contents}\n\n<sub><sup>[*Original URL*]({file['original_url']})</sup></sub><br><br>\n\n\n"
+                filename = download_file(file_url, staging_folder, file.get('size'))
+                if filename:
+                    blob_cache.add(file, file_path)
+            if filename:  # Check if file was successfully downloaded
+                files_list.append({'filename': filename, 'local_path': filename, 'original_url': file_url, 'data': file})
             else:
-                md_content += f"Local File: [{file['filename']}](<./{file['local_path']}>) | <sub><sup>[*Original URL*]({file['original_url']})</sup></sub><br><br>\n\n\n"
+                failed_downloads.append(file_url)
+
+    # Save all data and the file data to JSON, once everything is downloaded
+    staged = {'equipment_data': item, 'files': files_list}
+    if(failed_downloads):
+        staged['failed_downloads'] = failed_downloads  # Read by commit_item, also after resuming
+    with open(data_file_path, 'w') as f:
+        json.dump(staged, f, indent=4)
+    export_state.record_stage(item, 'downloaded', staging_folder, folder_path)
+
+    # Update progress
+    if(not verbose):
+        report_progress(index, total, len(files_list), equipment_name)
+    else:
+        print(f"   Created .JSON file: {data_file_path}")
 
-        if(len(files_list) == 0):
-            md_content += f"\n#### *No files for this document.*\n\n"
-        
-        
-        md_content += f"\n---\n"
-        current_datetime = datetime.datetime.now()
-        formatted_date = current_datetime.strftime('%d.%m.%Y - %H:%M')
-        md_content += f"<br><br><sub><sup>Export Date: {formatted_date}</sub></sup>\n"
+    # Render md, PDF, QR codes and sheet in the process pool; the next item can be fetched meanwhile
+    submit_render(item, staging_folder, folder_path, eq_name, files_list)
 
-        md_file_path = os.path.join(folder_path, 'data.md')
-        with open(md_file_path, 'w') as f:
-            f.write(md_content)
 
-        if(verbose):
-            print(f"   Created .MD file:   {md_file_path}")
 
-        # Convert .md to .PDF
-        pdf_path = os.path.join(folder_path, f"{eq_name}.pdf")
-        convert_md_to_pdf(md_file_path, pdf_path, folder_path)
-        # compress_pdf(pdf_path, 125, 5)
+def export_item_measured(index, item, total):
+    # Timings of the stages of this thread are counted for this item
+    with measure_item(item['code']):
+        export_item(index, item, total)
+
+def report_metrics(started, profiler=None):
+    """Print where the time of the run went and write --metrics and --profile."""
+    metrics = runMetrics.collect(time.monotonic() - started, endpoint_stats)
+    runMetrics.print_summary(metrics)
+    if(args.metrics):
+        runMetrics.write_metrics(args.metrics, metrics)
+        print(f"Metrics written to {args.metrics}")
+    if(profiler):
+        profiler.disable()
+        profiler.dump_stats(args.profile)
+        print(f"Profile written to {args.profile} (python3 -m pstats {args.profile})")
 
-        if(verbose):
-            print(f"   Created .PDF file:  {pdf_path}")
-
-        # Create QRCODE svg from euqipment serial number
-        serial_numbers = [num.strip() for num in item['qrcodes_of_serial_numbers'].split(",") if num.strip()]
-        qr_codes_html = ""
-        for number in serial_numbers:
-            qr_path = os.path.join(folder_path, f"{eq_name}-{number}-qr.svg")
-            qr_codes_html += f'<div class="qr"><img src="{eq_name}-{number}-qr.svg" alt=""> {number}</div>\n        '
-            generate_qr_code(qr_path, number)
-            if(verbose):
-                print(f"   Created QR code:  {number}")
-
-        # Make equipment sheet html
-        html_path = os.path.join(folder_path, f"{eq_name}-sheet.html")
-        # Get base file from equipment-sheet.html
-        # Read the HTML template into a variable
-        with open('equipment-sheet.html', 'r') as file:
-            html_content = file.read()
-
-        # Replace the placeholders in the HTML content
-        """
-            %%name%% => item['displayname']
-            %%img_1%% => if(len(image_list) > 0) image_list[0]
-            %%img_2%% => if(len(image_list) > 1) image_list[1]
-            %%amount%% => len(serial_numbers)
-            %%code%% => item['code']
-            %%length%% => item['length']
-            %%width%% => item['width']
-            %%height%% => item['height']
-            %%qr_codes%% => qr_codes_html
-        """
-        html_content = html_content.replace('%%name%%', item['displayname'])
-        # Choose image that is set as poster image by rentman user
-        if(item['image'] and len(image_list) > 0 and len(item['image']) > 0):
-            poster = int(os.path.basename(item['image']))
-            for img in files_list:
-                if poster == img["data"]["id"]:
-                    html_content = html_content.replace('%%img%%', img["local_path"])
-        html_content = html_content.replace('%%categories%%', category_path_list)
-        html_content = html_content.replace('%%amount%%', str(len(serial_numbers)))
-        html_content = html_content.replace('%%code%%', item['code'])
-        html_content = html_content.replace('%%length%%', str(item['length']))
-        html_content = html_content.replace('%%width%%', str(item['width']))
-        html_content = html_content.replace('%%height%%', str(item['height']))
-        html_content = html_content.replace('%%qr_codes%%', qr_codes_html)
-        # Fill new file
-        with open(html_path, 'w') as file:
-            file.write(html_content)
-        if(verbose):
-            print(f"   Created .HTML equipment sheet file:  {html_path}")
-        
-        # Make equipment sheet pdf from html
-        pdf_path_sheet = os.path.join(folder_path, f"{eq_name}-sheet.pdf")
-        convert_html_to_pdf(html_path, pdf_path_sheet)
-        if(verbose):
-            print(f"   Created .PDF from equipment sheet .html file:  {pdf_path_sheet}")
-            
-        # Reduce file size of PDF
-        compress_pdf(pdf_path_sheet, "screen")
-        if(verbose):
-            print(f"   - Resized .PDF")
 
-        # Copy PDF to one folder for easy access if not in archive
-        pdf_path_collected = os.path.join("equipmentSheets", f"{eq_name}-sheet.pdf")
+def find_exported_items(root_folder):
+    """Yield (folder_path, data) of every complete export (data.json with files) below root_folder."""
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.startswith('.'))  # Not .staging or .trash
+        if 'data.json' not in filenames:
+            continue
         try:
-            # Dont copy sheet if article is in archive;
-            # ignore sheets without any images OR qr codes
-            if(not item.get('in_archive') and (len(image_list) > 0 or len(serial_numbers) > 0)):
-                shutil.copyfile(pdf_path_sheet, pdf_path_collected)
-                if(verbose):
-                    print(f"   - Copied .PDF to {pdf_path_collected}")
+            with open(os.path.join(dirpath, 'data.json'), 'r') as f:
+                data = json.load(f)
+        except (ValueError, OSError) as e:
+            print(f"\n   Cannot read {os.path.join(dirpath, 'data.json')}: {e}")
+            continue
+        if 'equipment_data' in data:  # Only the bare item was written, files were never downloaded
+            yield dirpath, data
+
+def render_existing_exports(root_folder):
+    """
+    Render md, PDFs, QR codes and sheets again from the data.json and files on disk,
+    without calling the API. Uses all CPU cores (see --render-workers).
+    """
+    exported_items = [(folder_path, data) for folder_path, data in find_exported_items(root_folder)
+                      if not specific_obj_export or int(data['equipment_data']['code']) in specific_obj_export]
+    print(f"Rendering {len(exported_items)} exported articles from '{root_folder}'…")
+    started = time.monotonic()
+    failed = 0
+    # Same arguments as the render stage of a normal export: item, folder path, eq_name, files
+    jobs = [(data['equipment_data'], folder_path, os.path.basename(folder_path), data['files']) for folder_path, data in exported_items]
+    # Encode the QR codes of all serial numbers in one go, the render processes then only link them
+    if('qr' in outputs):
+        get_qr_codes([number.strip() for job in jobs for number in job[0]['qrcodes_of_serial_numbers'].split(",") if number.strip()])
+
+    # With --sheet-batch, every task renders a group of items and lays out their sheets in one document
+    batch_size = max(1, sheet_batch)
+    tasks = [jobs[i:i + batch_size] for i in range(0, len(jobs), batch_size)]
+
+    def task_arguments(task):
+        # Measured under the code of the first item of the task, a batch is rendered as a whole
+        if(sheet_batch > 1):
+            return (task[0][0]['code'], render_items_batch, task, render_options)
+        return (task[0][0]['code'], render_item, *task[0], render_options)
+
+    executor = ProcessPoolExecutor(max_workers=render_workers, mp_context=render_context) if render_workers > 0 else None
+    if(executor):
+        futures = [executor.submit(run_measured, *task_arguments(task)) for task in tasks]
+    num_rendered = 0
+    for task_index, task in enumerate(tasks):
+        try:
+            if(executor):
+                _, render_metrics = futures[task_index].result()
+                merge_snapshot(render_metrics)
+            else:
+                run_measured(*task_arguments(task))
         except Exception as e:
-            print(f"   - An error occurred: {e} - Maybe folder 'equipmentSheets' in root is missing?")
-
+            failed += len(task)
+            print(f"\n   Rendering of '{', '.join(job[0]['code'] for job in task)}' failed: {e}")
+        num_rendered += len(task)
+        if(not verbose):
+            item, folder_path, eq_name, files_list = task[-1]
+            update_progress(num_rendered, len(jobs), len(files_list), eq_name)
+    if(executor):
+        executor.shutdown()
 
-    # Finish progress
+    elapsed = time.monotonic() - started
     sys.stdout.write('\n')
-    sys.stdout.flush()
-    if(specific_obj_export):
-        if(num_obj_exported):
-            print(f"Fetched {num_obj_exported} object(s) with code(s) {specific_obj_export} 🥳")
+    print(f"Rendered {len(jobs) - failed} articles in {elapsed:.1f}s ({len(jobs) / elapsed if elapsed else 0:.1f} articles/s) 🥳")
+
+def export_equipment(equipment_items, total_items, complete_list=False):
+    """
+    Export equipment_items and wait until all of them are rendered and committed.
+    complete_list: the items are the whole DB, so exported equipment that is missing was deleted in rentman.
+    Returns the "modified" date up to which every item is committed (for --watch): the newest of the
+    items, or just before the oldest item that failed, so the next check fetches that one again.
+    """
+    global num_obj_exported, num_obj_done
+    print(f"Collecting equipment data and creating files…")
+    num_obj_done = 0
+    failed_items.clear()
+
+    # All calls to api.rentman.net share one rate limiter (see rentmanApi.py),
+    # so the number of workers does not change the 20 calls/second budget.
+    executor = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+    # At most this many items are queued or exporting; the rest of the streamed list is not held in memory
+    item_slots = threading.BoundedSemaphore(2 * workers)
+    failures = []
+
+    def item_done(future, item):
+        try:
+            future.result()
+        except requests.exceptions.RequestException as e:
+            # Retries are exhausted for this item; keep exporting the rest
+            print(f"\n   Export of '{item['code']}' failed: {e}")
+            item_failed(item)
+        except Exception as e:
+            failures.append(e)  # Raised once the other items are finished
+        finally:
+            item_slots.release()
+
+    seen_ids = set()  # Everything else that was exported before is deleted in rentman
+    newest_modified = None
+    try:
+        for index, item in enumerate(equipment_items, start=1):  # Raises if a page of the list cannot be fetched
+            seen_ids.add(item['id'])
+            if(item.get('modified') and (newest_modified is None or modified_time(item['modified']) > modified_time(newest_modified))):
+                newest_modified = item['modified']
+            # if(specific_obj_export > 0 and int(item['code']) != specific_obj_export):
+            if specific_obj_export and int(item['code']) not in specific_obj_export:
+                # Skip if it's not in the list
+                # print(f"{specific_obj_export} is not {item['code']}")
+                continue  # Skip to the next iteration
+            num_obj_exported += 1
+            if(executor):
+                item_slots.acquire()
+                future = executor.submit(export_item_measured, index, item, total_items)
+                future.add_done_callback(lambda future, item=item: item_done(future, item))
+                continue
+            try:
+                export_item_measured(index, item, total_items)
+            except requests.exceptions.RequestException as e:
+                # Retries are exhausted for this item; keep exporting the rest
+                print(f"\n   Export of '{item['code']}' failed: {e}")
+                item_failed(item)
+    finally:
+        # Also when the list failed: the items that were started are finished and committed
+        if(executor):
+            executor.shutdown()  # Waits for the last items
+        if(render_pool):
+            wait_for_renders()  # Wait for the last PDFs
+    if(failures):
+        raise failures[0]
+
+    failed = [modified for modified in failed_items if modified]
+    if(failed):
+        # modified[gte] of the oldest failed item includes it in the next check
+        newest_modified = min(failed, key=modified_time)
+
+    if(complete_list and not args.keep_deleted):
+        # Only after listing the whole DB it is known what was deleted. The pages are fetched by offset:
+        # if equipment was deleted or added meanwhile, the offsets shifted and other equipment may have
+        # been missed (a short page or duplicates leave fewer ids than the API counted).
+        if(len(seen_ids) < total_items):
+            print(f"\nNot removing deleted equipment: the list changed while it was fetched ({len(seen_ids)} of {total_items} articles), checked again next time")
         else:
-            print(f"Object(s) with code(s) {specific_obj_export} does not exist.")
+            num_pruned = prune_deleted_items(seen_ids)
+            if(num_pruned):
+                print(f"Removed {num_pruned} equipment folder(s) of deleted equipment")
+    return newest_modified
+
+def publish_changes(root):
+    """--publish: bring the published copy up to date, only what changed is linked or written again."""
+    if(not args.publish):
+        return
+    try:
+        with timed('publish'):
+            stats = publish_export(root, args.publish, args.publish_format)
+    except (OSError, ValueError) as e:
+        print(f"Publishing to '{args.publish}' failed: {e}")
+        return
+    print_publish_stats(args.publish, stats)
+
+def modified_time(modified):
+    # "2024-02-11T16:36:24+01:00"; compared as time, the offset may differ
+    return datetime.datetime.fromisoformat(modified)
+
+def reset_bulk_lookups():
+    """Forget the bulk lookups of the previous cycle, the files and quantities may have changed since."""
+    global bulk_lookups_requested, files_by_equipment, quantities_by_equipment
+    with bulk_lock:
+        bulk_lookups_requested = 0
+        files_by_equipment = None
+        quantities_by_equipment = None
+
+def get_changed_equipment(since):
+    """
+    Equipment modified since (a "modified" date of rentman), filtered by the API.
+    "modified" has whole seconds: equipment changed in the same second as the newest one of the
+    last check is only found with modified[gte]. The versions that were already exported are left out.
+    """
+    with timed('list'):
+        items = [item for records in api_get_pages(f"{BASE_URL}/equipment", JWT_TOKEN, params={"modified[gte]": since}) for item in records]
+    return [item for item in items if not export_state.version_exported(item, outputs)]
+
+def categories_changed(since):
+    """True if a category (folder) was created, renamed or moved since (modified[gte], see get_changed_equipment)."""
+    with timed('list'):
+        folders = api_get_json(f"{BASE_URL}/folders", JWT_TOKEN, params={"modified[gte]": since}).get('data', [])
+    version = lambda folder: (folder.get('modified'), folder.get('updateHash'))
+    return any(folder['id'] not in categories or version(categories[folder['id']]) != version(folder) for folder in folders)
+
+def watch_for_changes():
+    """
+    --watch: export everything once, then check every --interval seconds for equipment that
+    changed in rentman since the last check and export only that. The process, its HTTP
+    connections, render processes, categories and state stay warm between the checks.
+    A changed category (renamed, moved) or --full-interval triggers a complete export again,
+    which also notices moved and deleted equipment.
+    """
+    global categories, num_obj_exported
+    since = None           # Newest "modified" date of the equipment seen so far
+    folders_since = None   # Newest "modified" date of the categories
+    last_full_export = 0
+    print(f"Watching for changes every {args.interval:g}s, press CTRL and C to stop.")
+    try:
+        while True:
+            started = time.monotonic()
+            reset_bulk_lookups()
+            num_obj_exported = 0
+            full_export = False
+            try:
+                full_export = (since is None or folders_since is None or started - last_full_export >= args.full_interval
+                               or categories_changed(folders_since))
+                if(full_export):
+                    categories = get_categories()
+                    total_items, equipment_items = get_all_equipment()
+                    print(f"Found {total_items} articles in DB.")
+                    newest = export_equipment(equipment_items, total_items, complete_list=True)
+                    last_full_export = started
+                    folders_since = max((folder['modified'] for folder in categories.values() if folder.get('modified')), key=modified_time, default=None)
+                else:
+                    changed_items = get_changed_equipment(since)
+                    if(any(item.get('folder') and int(os.path.basename(item['folder'])) not in categories for item in changed_items)):
+                        categories = get_categories()  # A new category
+                    newest = export_equipment(changed_items, len(changed_items)) if changed_items else None
+                if(newest and (since is None or modified_time(newest) > modified_time(since))):
+                    since = newest
+            except requests.exceptions.RequestException as e:
+                # Retries are exhausted (eg. the API is down): keep watching, since stays where it was
+                print(f"\n{datetime.datetime.now():%d.%m.%Y %H:%M:%S} Check failed, trying again in {args.interval:g}s: {e}")
+            if(full_export or num_obj_exported):
+                sys.stdout.write('\n')
+                print(f"{datetime.datetime.now():%d.%m.%Y %H:%M:%S} {'Complete export' if full_export else 'Changes'}: {num_obj_exported} articles checked in {time.monotonic() - started:.1f}s")
+                publish_changes(root_folder)
+                # --cache-size applies while watching, not only when the process ends
+                blob_cache.evict()
+                evict_derivatives()
+            time.sleep(max(0, args.interval - (time.monotonic() - started)))
+    except KeyboardInterrupt:
+        print(f"\nStopped watching.")
+
+
+# Main script
+if __name__ == '__main__':
+    run_started = time.monotonic()
+    profiler = None
+    if(args.profile):
+        # Profiles the main thread; the render processes report their stage timings instead
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    if(args.render_only):
+        render_existing_exports('equipmentDump')
+        publish_changes('equipmentDump')
+        evict_derivatives()
+        report_metrics(run_started, profiler)
+        sys.exit(0)
+
+    JWT_TOKEN = load_file_content('JWT_TOKEN')
+
+    if(num_obj_to_export > 0):
+        print(f"Limit export of {num_obj_to_export} equipment. Change in the code to any other integer or to 0 if you want to export everything.\n")
+    elif(specific_obj_export):
+        print(f"Fetch {len(specific_obj_export)} object(s) with code(s) {specific_obj_export}\n")
     else:
-        print(f"\nData collection of {len(equipment_items)} equipment pieces complete 🥳")
+        print(f"Reading database, export everything.\n")
+
+    root_folder = 'equipmentDump'
+    os.makedirs(root_folder, exist_ok=True)  # Create root directory
+    empty_trash(root_folder)  # Previous folders of items committed by a run that was stopped
+    export_state = ExportState()  # Remembers modified/updateHash of exported equipment and files
+    blob_cache = BlobCache(max_bytes=int(args.cache_size * 1024 ** 3))  # Downloaded files by rentman file id
+    catalog = Catalog()  # All exported equipment in one database: equipmentDump/catalog.sqlite
+    if(catalog.is_empty()):
+        # Unchanged equipment is not exported again, so take what is already on disk
+        for folder_path, data in find_exported_items(root_folder):
+            catalog.update_item(data['equipment_data'], os.path.relpath(folder_path, root_folder), data['files'], extra_input_fields)
+
+    if(render_workers > 0):
+        render_pool = ProcessPoolExecutor(max_workers=render_workers, mp_context=render_context)
+
+    if(args.watch):
+        watch_for_changes()
+    else:
+        # Let the API do the selection, a one item export should not list the whole DB
+        if(specific_obj_export):
+            equipment_items = get_equipment_by_codes(specific_obj_export)
+            total_items = len(equipment_items)
+            categories = get_categories_of(equipment_items)
+            print(f"Found {total_items} of {len(specific_obj_export)} articles in DB.")
+        elif(num_obj_to_export > 0):
+            equipment_items = get_equipment_range(start_index, num_obj_to_export)
+            total_items = len(equipment_items)
+            categories = get_categories_of(equipment_items)
+            print(f"Found {total_items} articles in DB from index {start_index} on.")
+        else:
+            categories = get_categories()  # Retrieve all folders (aka categories)
+            total_items, equipment_items = get_all_equipment()  # Streamed, the rest of the pages arrive while exporting
+            print(f"Found {total_items} articles in DB.")
+        print(f"-------------------------------")
+
+        export_equipment(equipment_items, total_items, complete_list=not specific_obj_export and num_obj_to_export <= 0)
+
+        # Finish progress
+        sys.stdout.write('\n')
+        sys.stdout.flush()
+        if(specific_obj_export):
+            if(num_obj_exported):
+                print(f"Fetched {num_obj_exported} object(s) with code(s) {specific_obj_export} 🥳")
+            else:
+                print(f"Object(s) with code(s) {specific_obj_export} does not exist.")
+        else:
+            print(f"\nData collection of {num_obj_exported} equipment pieces complete 🥳")
+        publish_changes(root_folder)
+
+    if(render_pool):
+        render_pool.shutdown(wait=True)
+    export_state.close()
+    catalog.close()
+    blob_cache.evict()
+    blob_cache.close()
+    evict_derivatives()
+    report_metrics(run_started, profiler)
@@ -0,0 +1,193 @@
+import json
+import os
+import sqlite3
+import threading
+import datetime
+
+# Lives next to the "equipmentDump" folder
+STATE_DB = 'exportState.sqlite'
+
+# An equipment whose rendering failed (eg. LaTeX cannot embed an image) or one of whose files could
+# not be downloaded is exported without the missing files and exported again in this many runs;
+# after that only when it changes in rentman
+MAX_EXPORT_ATTEMPTS = 3
+
+
+class ExportState:
+    """
+    Remembers what has been exported: the "modified" and "updateHash" of every equipment
+    and the id and "modified" of every file. Used to only export equipment that changed
+    in rentman since the last run.
+    Also holds the journal of the current run: which stages of an equipment that is
+    being built in its staging folder are finished ('downloaded', 'rendered'), so a run
+    that was stopped resumes with the first unfinished stage.
+    Safe to share between worker threads.
+    """
+    def __init__(self, db_path=STATE_DB):
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(db_path, check_same_thread=False)
+        self.db.executescript("""
+            CREATE TABLE IF NOT EXISTS equipment (
+                id INTEGER PRIMARY KEY,
+                code TEXT,
+                modified TEXT,
+                update_hash TEXT,
+                folder_path TEXT,
+                exported_at TEXT,
+                outputs TEXT,
+                missing_outputs TEXT,
+                render_attempts INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS files (
+                id INTEGER PRIMARY KEY,
+                equipment_id INTEGER,
+                modified TEXT,
+                filename TEXT
+            );
+            CREATE INDEX IF NOT EXISTS files_equipment_id ON files (equipment_id);
+            CREATE TABLE IF NOT EXISTS journal (
+                equipment_id INTEGER PRIMARY KEY,
+                modified TEXT,
+                update_hash TEXT,
+                stage TEXT,
+                staging_path TEXT,
+                folder_path TEXT,
+                updated_at TEXT
+            );
+        """)
+        columns = [column[1] for column in self.db.execute("PRAGMA table_info(equipment)")]
+        for column, column_type in (('outputs', 'TEXT'), ('missing_outputs', 'TEXT'), ('render_attempts', 'INTEGER')):
+            if column not in columns:
+                self.db.execute(f"ALTER TABLE equipment ADD COLUMN {column} {column_type}")  # State store of an older version
+        self.db.commit()
+
+    def equipment_changed(self, item, folder_path, outputs=None):
+        """
+        True if the equipment was never exported, changed in rentman, its data.json is gone
+        or it was exported without some of the outputs (eg. 'pdf', see --outputs) wanted now
+        or because their rendering or a download ('files') failed (at most MAX_EXPORT_ATTEMPTS times).
+        Equipment exported before the state store existed is adopted from its data.json.
+        """
+        data_file_path = os.path.join(folder_path, 'data.json')
+        if not os.path.isfile(data_file_path):
+            return True
+        with self.lock:
+            row = self.db.execute("SELECT modified, update_hash, outputs, missing_outputs, render_attempts FROM equipment WHERE id = ?", (item['id'],)).fetchone()
+        if row is not None and row[2] and outputs and not set(outputs) <= set(row[2].split(',')):
+            return True
+        if row is not None and row[3] and (row[4] or 0) < MAX_EXPORT_ATTEMPTS:
+            return True
+        if row is None:
+            try:
+                with open(data_file_path, 'r') as f:
+                    exported = json.load(f).get('equipment_data', {})
+            except (ValueError, OSError):
+                return True
+            row = (exported.get('modified'), exported.get('updateHash'))
+        return row[:2] != (item.get('modified'), item.get('updateHash'))
+
+    def version_exported(self, item, outputs=None):
+        """
+        True if this version ("modified" and "updateHash") of the equipment was exported with all
+        outputs and nothing left to export again. Does not look at the folder, see equipment_changed.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT modified, update_hash, outputs, missing_outputs, render_attempts FROM equipment WHERE id = ?", (item['id'],)).fetchone()
+        if row is None or (row[0], row[1]) != (item.get('modified'), item.get('updateHash')):
+            return False
+        if row[2] and outputs and not set(outputs) <= set(row[2].split(',')):
+            return False
+        return not (row[3] and (row[4] or 0) < MAX_EXPORT_ATTEMPTS)
+
+    def file_unchanged(self, file_data, file_path):
+        """True if this file id was already downloaded with the same "modified" and is still on disk."""
+        if not os.path.isfile(file_path):
+            return False
+        with self.lock:
+            row = self.db.execute("SELECT modified FROM files WHERE id = ?", (file_data['id'],)).fetchone()
+        return row is not None and row[0] == file_data.get('modified')
+
+    def record_equipment(self, item, folder_path, files_list, outputs=None, missing=None):
+        """
+        Store the state of an equipment after it has been exported (with outputs, None: all).
+        missing: outputs that failed ('files' if a download failed, else the files the rendering failed to create);
+        counts the failed attempts for the same version.
+        Returns the number of failed attempts in a row (0 if nothing is missing).
+        """
+        exported_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            render_attempts = 0
+            if missing:
+                row = self.db.execute("SELECT modified, update_hash, render_attempts FROM equipment WHERE id = ?", (item['id'],)).fetchone()
+                same_version = row is not None and (row[0], row[1]) == (item.get('modified'), item.get('updateHash'))
+                render_attempts = (row[2] or 0) + 1 if same_version else 1
+            self.db.execute(
+                "INSERT OR REPLACE INTO equipment (id, code, modified, update_hash, folder_path, exported_at, outputs, missing_outputs, render_attempts) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (item['id'], item.get('code'), item.get('modified'), item.get('updateHash'), folder_path, exported_at,
+                 ','.join(sorted(outputs)) if outputs else None, ','.join(missing) if missing else None, render_attempts)
+            )
+            self.db.execute("DELETE FROM files WHERE equipment_id = ?", (item['id'],))
+            self.db.executemany(
+                "INSERT OR REPLACE INTO files (id, equipment_id, modified, filename) VALUES (?, ?, ?, ?)",
+                [(file['data']['id'], item['id'], file['data'].get('modified'), file['filename']) for file in files_list]
+            )
+            self.db.commit()
+        return render_attempts
+
+    def exported_folder(self, equipment_id):
+        """Folder the equipment was last exported to, or None."""
+        with self.lock:
+            row = self.db.execute("SELECT folder_path FROM equipment WHERE id = ?", (equipment_id,)).fetchone()
+        return row[0] if row else None
+
+    def exported_folders(self):
+        """{equipment id: folder} of all exported equipment."""
+        with self.lock:
+            return dict(self.db.execute("SELECT id, folder_path FROM equipment").fetchall())
+
+    def move_equipment(self, equipment_id, folder_path):
+        """The folder of an exported equipment was renamed."""
+        with self.lock:
+            self.db.execute("UPDATE equipment SET folder_path = ? WHERE id = ?", (folder_path, equipment_id))
+            self.db.commit()
+
+    def forget_equipment(self, equipment_id):
+        """The equipment was deleted in rentman and its folder removed."""
+        with self.lock:
+            self.db.execute("DELETE FROM equipment WHERE id = ?", (equipment_id,))
+            self.db.execute("DELETE FROM files WHERE equipment_id = ?", (equipment_id,))
+            self.db.execute("DELETE FROM journal WHERE equipment_id = ?", (equipment_id,))
+            self.db.commit()
+
+    def finished_stage(self, item, staging_path):
+        """
+        Last finished stage of an equipment in its staging folder, or None if there is nothing
+        to resume: no journal entry, the staging folder is gone or the equipment changed since.
+        """
+        with self.lock:
+            row = self.db.execute("SELECT modified, update_hash, stage, staging_path FROM journal WHERE equipment_id = ?", (item['id'],)).fetchone()
+        if row is None or row[3] != staging_path or not os.path.isfile(os.path.join(staging_path, 'data.json')):
+            return None
+        if (row[0], row[1]) != (item.get('modified'), item.get('updateHash')):
+            return None
+        return row[2]
+
+    def record_stage(self, item, stage, staging_path, folder_path):
+        """Journal that a stage of an equipment is finished; its files are complete in staging_path."""
+        updated_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with self.lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO journal (equipment_id, modified, update_hash, stage, staging_path, folder_path, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (item['id'], item.get('modified'), item.get('updateHash'), stage, staging_path, folder_path, updated_at)
+            )
+            self.db.commit()
+
+    def clear_stages(self, equipment_id):
+        """The equipment is committed to its folder, nothing left to resume."""
+        with self.lock:
+            self.db.execute("DELETE FROM journal WHERE equipment_id = ?", (equipment_id,))
+            self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,88 @@
+import hashlib
+import os
+import re
+import requests
+from rentmanApi import file_get
+import runMetrics
+
+CHUNK_SIZE = 64 * 1024
+PARTIAL_SUFFIX = '.part'  # Unfinished downloads, resumed on the next run
+
+
+def etag_md5(response):
+    """The ETag of S3 is the MD5 of the content, unless the file was uploaded in parts ("…-3"). None if not usable."""
+    etag = response.headers.get('ETag', '').strip('"')
+    return etag.lower() if re.fullmatch(r'[0-9a-fA-F]{32}', etag) else None
+
+def md5_of_file(file_path):
+    md5 = hashlib.md5()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            md5.update(chunk)
+    return md5
+
+def download_to_file(url, file_path, expected_size=None):
+    """
+    Stream an url to file_path without loading it into memory.
+
+    The data is written to "<file_path>.part" and only renamed to file_path when it is
+    complete, so an interrupted run never leaves a truncated file behind. An existing
+    .part file is resumed with an HTTP Range request.
+    The result is checked against expected_size (the "size" rentman returns for the file)
+    and against the MD5 ETag of S3 if there is one.
+
+    Returns True on success, False otherwise (the .part file is kept if it can be resumed).
+    """
+    part_path = file_path + PARTIAL_SUFFIX
+    resume_from = os.path.getsize(part_path) if os.path.isfile(part_path) else 0
+    if expected_size and resume_from >= expected_size:
+        # Nothing left to fetch, or the partial file is bigger than it should be - start over
+        os.remove(part_path)
+        resume_from = 0
+
+    headers = {'Range': f"bytes={resume_from}-"} if resume_from else None
+    try:
+        response = file_get(url, stream=True, headers=headers)
+    except requests.exceptions.RequestException as e:
+        print(f"\n      Download of '{url}' failed: {e}")
+        return False
+
+    with response:
+        if response.status_code == 206:
+            mode = 'ab'
+            md5 = md5_of_file(part_path)  # The ETag covers the whole file, including what we already have
+        elif response.status_code == 200:
+            mode = 'wb'  # Server ignored the Range header, start from scratch
+            md5 = hashlib.md5()
+        else:
+            print(f"\n      Download of '{url}' failed: HTTP {response.status_code}")
+            return False
+
+        num_bytes = 0
+        try:
+            with open(part_path, mode) as f:
+                for chunk in response.iter_content(chunk_size=CHUNK_SIZE):
+                    f.write(chunk)
+                    md5.update(chunk)
+                    num_bytes += len(chunk)
+        except requests.exceptions.RequestException as e:
+            # Keep the .part file, the next run continues from here
+            print(f"\n      Download of '{url}' interrupted: {e}")
+            return False
+        finally:
+            runMetrics.count('bytes_downloaded', num_bytes)
+        expected_md5 = etag_md5(response)  # S3 also sends the ETag of the whole file on 206
+
+    size = os.path.getsize(part_path)
+    if expected_size and size != expected_size:
+        print(f"\n      Download of '{url}' incomplete: {size} of {expected_size} bytes")
+        if size > expected_size:
+            os.remove(part_path)
+        return False
+    if expected_md5 and md5.hexdigest() != expected_md5:
+        print(f"\n      Download of '{url}' is corrupt (checksum mismatch) - removed")
+        os.remove(part_path)
+        return False
+
+    os.replace(part_path, file_path)  # Atomic: file_path is either the old or the complete new file
+    return True
@@ -0,0 +1,96 @@
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional, without it the PDFs use the original images
+    Image = None
+
+# Lives next to the "equipmentDump" folder
+DERIVATIVE_DIR = 'imageDerivatives'
+
+# Longest side in pixels: the sheet image is max. 19cm wide, ~200 dpi is plenty for print
+SHEET_IMAGE_SIZE = 1600
+FORMAT = 'JPEG'  # or 'WEBP'
+QUALITY = 80
+# The least recently used copies are removed above this size, see evict_derivatives
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def content_hash(path):
+    sha = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def derivative_path(source_path, max_size, image_format=FORMAT, source_key=None):
+    """
+    Cache path of a downscaled copy, keyed by the content of the source and the target size.
+    source_key identifies the content without reading it (eg. rentman file id and "modified");
+    the mtime does not, it changes whenever a file is linked, copied or downloaded again.
+    """
+    source_key = source_key or content_hash(source_path)
+    key = hashlib.sha1(f"{source_key}|{max_size}|{image_format}|{QUALITY}".encode()).hexdigest()
+    extension = 'jpg' if image_format == 'JPEG' else image_format.lower()
+    return os.path.join(DERIVATIVE_DIR, key[:2], f"{key}.{extension}")
+
+def make_derivative(source_path, max_size=SHEET_IMAGE_SIZE, image_format=FORMAT, source_key=None):
+    """
+    Path of a copy of source_path that is at most max_size pixels wide and high.
+    Created once and then taken from the cache; the original is never touched.
+    Returns source_path itself if the image is already small or cannot be read.
+    """
+    if Image is None:
+        return source_path
+    try:
+        target_path = derivative_path(source_path, max_size, image_format, source_key)
+        if os.path.isfile(target_path):
+            os.utime(target_path)  # Recently used, see evict_derivatives (only referenced by url, never linked)
+            return target_path
+        with Image.open(source_path) as img:
+            if max(img.size) <= max_size:
+                return source_path
+            img = ImageOps.exif_transpose(img)  # Photos of phones are often only rotated by their EXIF data
+            img.thumbnail((max_size, max_size))
+            if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+                img = img.convert('RGB')
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            tmp_path = f"{target_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            img.save(tmp_path, image_format, quality=QUALITY, optimize=True)
+            os.replace(tmp_path, target_path)
+        return target_path
+    except (OSError, ValueError) as e:
+        print(f"\n      Could not downscale '{source_path}': {e}")
+        return source_path
+
+def make_derivatives(source_paths, max_size=SHEET_IMAGE_SIZE, image_format=FORMAT, workers=4, source_keys=None):
+    """
+    Downscaled copies of several images, made in parallel (Pillow releases the GIL while resizing).
+    source_keys: {source path: key of its content}, see derivative_path.
+    Returns {source path: absolute path of the copy to use}.
+    """
+    source_keys = source_keys or {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        targets = executor.map(lambda source_path: make_derivative(source_path, max_size, image_format, source_keys.get(source_path)), source_paths)
+        return {source_path: os.path.abspath(target) for source_path, target in zip(source_paths, targets)}
+
+def evict_derivatives(max_bytes=MAX_CACHE_BYTES):
+    """Remove the least recently used copies until the cache is smaller than max_bytes. Returns the number removed."""
+    copies = []
+    for dirpath, _, filenames in os.walk(DERIVATIVE_DIR):
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            stat = os.stat(path)
+            copies.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in copies)
+    removed = 0
+    for _, size, path in sorted(copies):
+        if total <= max_bytes:
+            break
+        os.remove(path)
+        total -= size
+        removed += 1
+    return removed
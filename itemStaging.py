@@ -0,0 +1,105 @@
+import os
+import shutil
+import time
+from blobCache import link_or_copy
+from fileDownloads import PARTIAL_SUFFIX
+
+# Inside the "equipmentDump" folder (same file system, so a folder can be renamed into place).
+# Folders starting with a dot are not exports, see find_exported_items.
+STAGING_DIR = '.staging'
+TRASH_DIR = '.trash'
+
+
+def staging_path(root_folder, equipment_id):
+    """Folder in which an equipment is built before it replaces its folder in root_folder."""
+    return os.path.join(root_folder, STAGING_DIR, str(equipment_id))
+
+def reset_staging(staging_folder):
+    """
+    Empty the staging folder of an equipment for a new build, but keep unfinished downloads
+    (.part files): download_to_file resumes them with a Range request.
+    """
+    if os.path.isdir(staging_folder):
+        for entry in os.scandir(staging_folder):
+            if entry.is_dir(follow_symlinks=False):
+                shutil.rmtree(entry.path, ignore_errors=True)
+            elif not entry.name.endswith(PARTIAL_SUFFIX):
+                os.remove(entry.path)
+    os.makedirs(staging_folder, exist_ok=True)
+
+def rendered_output(filename, eq_name):
+    """The output ('json', 'md', 'pdf', 'qr', 'sheet') filename is for an equipment named eq_name, or None."""
+    outputs = {'data.json': 'json', 'data.md': 'md', f"{eq_name}.pdf": 'pdf',
+               f"{eq_name}-sheet.html": 'sheet', f"{eq_name}-sheet.pdf": 'sheet'}
+    if filename in outputs:
+        return outputs[filename]
+    if filename.startswith(f"{eq_name}-") and filename.endswith('-qr.svg'):
+        return 'qr'
+    return None
+
+def carry_over_files(folder_path, staging_folder, exported_files=(), eq_name=None, kept_outputs=()):
+    """
+    Link the files of the previous export that the new one does not contain (eg. files added
+    by hand) into the staging folder, so committing it does not lose them.
+    Files of the previous export itself (exported_files and the rendered files of eq_name)
+    are left behind, they were either replaced or removed in rentman. Except the rendered
+    files of kept_outputs: outputs that were not made again (see --outputs) are kept.
+    """
+    if not os.path.isdir(folder_path):
+        return
+    for entry in os.scandir(folder_path):
+        if not entry.is_file() or entry.name.endswith('.part') or entry.name in exported_files:
+            continue
+        if eq_name and rendered_output(entry.name, eq_name) not in (None, *kept_outputs):
+            continue
+        if not os.path.lexists(os.path.join(staging_folder, entry.name)):
+            link_or_copy(entry.path, os.path.join(staging_folder, entry.name))
+
+def commit_folder(staging_folder, folder_path, root_folder):
+    """
+    Put the completely built staging folder in place of folder_path.
+    Both are renames within root_folder; the previous folder is moved to the trash first
+    and only deleted once the new one is in place.
+    """
+    for entry in os.scandir(staging_folder):
+        if entry.name.endswith(PARTIAL_SUFFIX):
+            os.remove(entry.path)  # A download that failed, not part of the export
+    os.makedirs(os.path.dirname(folder_path), exist_ok=True)
+    trash_path = None
+    if os.path.isdir(folder_path):
+        os.makedirs(os.path.join(root_folder, TRASH_DIR), exist_ok=True)
+        trash_path = os.path.join(root_folder, TRASH_DIR, f"{os.path.basename(staging_folder)}-{time.time_ns()}")
+        os.rename(folder_path, trash_path)
+    os.rename(staging_folder, folder_path)
+    if trash_path:
+        shutil.rmtree(trash_path, ignore_errors=True)
+
+def remove_empty_parents(path, root_folder):
+    """Remove the folders above path that became empty (eg. a renamed category), up to root_folder."""
+    parent = os.path.dirname(os.path.abspath(path))
+    root = os.path.abspath(root_folder)
+    while parent.startswith(root + os.sep):
+        try:
+            os.rmdir(parent)
+        except OSError:
+            break  # Not empty
+        parent = os.path.dirname(parent)
+
+def move_folder(old_path, new_path, root_folder):
+    """Rename the folder of an equipment (other category, name or archived) instead of exporting it again."""
+    os.makedirs(os.path.dirname(new_path), exist_ok=True)
+    os.rename(old_path, new_path)
+    remove_empty_parents(old_path, root_folder)
+
+def remove_folder(folder_path, root_folder):
+    """Delete the folder of an equipment that no longer exists in rentman."""
+    if os.path.isdir(folder_path):
+        os.makedirs(os.path.join(root_folder, TRASH_DIR), exist_ok=True)
+        trash_path = os.path.join(root_folder, TRASH_DIR, f"deleted-{time.time_ns()}")
+        os.rename(folder_path, trash_path)
+        shutil.rmtree(trash_path, ignore_errors=True)
+    remove_empty_parents(folder_path, root_folder)
+
+def empty_trash(root_folder):
+    """Delete previous folders left over by a run that stopped while committing."""
+    shutil.rmtree(os.path.join(root_folder, TRASH_DIR), ignore_errors=True)
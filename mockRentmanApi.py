@@ -0,0 +1,279 @@
+import argparse
+import copy
+import datetime
+import hashlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Local stand-in for api.rentman.net, to measure the export without the live API and its rate limit:
+#   python3 mockRentmanApi.py --items 2000 --latency 50 --error-rate 0.02
+#   RENTMAN_BASE_URL=http://127.0.0.1:8765 python3 collectEverything.py
+# The equipment is made from the data.json files and files in "example_output" (see load_fixtures).
+
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'example_output')
+
+# Added to the equipment by collectEverything.py, not part of the rentman data
+EXPORT_ONLY_FIELDS = ('folder_path',)
+# Only in /equipment/{id}, not in the /equipment list
+DETAIL_ONLY_FIELDS = ('current_quantity_excl_cases', 'current_quantity', 'quantity_in_cases')
+
+MAX_LIMIT = 300  # Records per page of a collection, like rentman
+
+
+def load_fixtures(fixtures_dir=FIXTURES_DIR):
+    """
+    Equipment, its files and categories from the data.json files of an export:
+    returns a list of (equipment, [(file data, content), ..]) and {folder id: category path}.
+    Files that are missing next to the data.json get zero bytes of their size.
+    """
+    fixtures = []
+    folders = {}
+    for dirpath, dirnames, filenames in os.walk(fixtures_dir):
+        dirnames.sort()
+        if 'data.json' not in filenames:
+            continue
+        with open(os.path.join(dirpath, 'data.json'), 'r') as f:
+            data = json.load(f)
+        if 'equipment_data' not in data:
+            continue
+        equipment = data['equipment_data']
+        if equipment.get('folder') and equipment.get('folder_path'):
+            folders[int(os.path.basename(equipment['folder']))] = equipment['folder_path']
+        files = []
+        for file in data['files']:
+            file_path = os.path.join(dirpath, file['filename'])
+            if os.path.isfile(file_path):
+                with open(file_path, 'rb') as f:
+                    content = f.read()
+            else:
+                content = bytes(file['data'].get('size') or 0)
+            files.append((file['data'], content))
+        fixtures.append((equipment, files))
+    return fixtures, folders
+
+
+class MockRentman:
+    """
+    Synthetic equipment database: num_items articles cloned from the fixtures, each with
+    its own id, code, QR codes and files, in the categories of the fixtures.
+    """
+    def __init__(self, num_items=100, fixtures_dir=FIXTURES_DIR):
+        fixtures, folder_paths = load_fixtures(fixtures_dir)
+        if not fixtures:
+            raise ValueError(f"No data.json files found in '{fixtures_dir}'")
+        self.base_url = ''  # Set by start_server, the file urls point to this server
+        self.folders = {}
+        for folder_id, path in folder_paths.items():
+            self.folders[folder_id] = {'id': folder_id, 'modified': '2024-01-01T00:00:00+01:00', 'displayname': os.path.basename(path),
+                                       'name': os.path.basename(path), 'parent': None, 'itemtype': 'equipment', 'path': path}
+        self.equipment = []
+        self.files = {}     # {equipment id: [file data, ..]}
+        self.blobs = {}     # {file id: content}
+        for index in range(num_items):
+            template, template_files = fixtures[index % len(fixtures)]
+            equipment_id = 10000 + index
+            item = copy.deepcopy(template)
+            for field in EXPORT_ONLY_FIELDS:
+                item.pop(field, None)
+            item.update({
+                'id': equipment_id,
+                'code': str(index + 1),
+                'qrcodes': str(2000000 + index),
+                'qrcodes_of_serial_numbers': str(3000000 + index) if template.get('qrcodes_of_serial_numbers') else '',
+                'name': f"{template.get('name', 'Unknown')} {index + 1}",
+                'displayname': f"{template.get('displayname', 'Unknown')} {index + 1}",
+                'updateHash': hashlib.md5(f"{equipment_id}".encode()).hexdigest(),
+            })
+            files = []
+            for file_index, (file_data, content) in enumerate(template_files):
+                file_id = 100000 + index * 100 + file_index
+                file = dict(file_data, id=file_id, item=equipment_id, size=len(content))
+                file['name'] = f"{file_id}_{file_data.get('displayname') or file_data.get('readable_name') or 'file'}"
+                files.append(file)
+                self.blobs[file_id] = content
+                if template.get('image') == f"/files/{file_data['id']}":
+                    item['image'] = f"/files/{file_id}"
+            self.files[equipment_id] = files
+            self.equipment.append(item)
+        self.by_id = {item['id']: item for item in self.equipment}
+
+    def file_record(self, file):
+        record = {key: value for key, value in file.items() if key != 'name'}
+        record['url'] = f"{self.base_url}/blobs/{file['id']}/{urllib.parse.quote(file['name'])}"
+        return record
+
+
+def modified_after(records, query):
+    """The "modified[gt]" and "modified[gte]" filters of rentman."""
+    if 'modified[gt]' in query:
+        since = datetime.datetime.fromisoformat(query['modified[gt]'])
+        return [record for record in records if datetime.datetime.fromisoformat(record['modified']) > since]
+    if 'modified[gte]' in query:
+        since = datetime.datetime.fromisoformat(query['modified[gte]'])
+        return [record for record in records if datetime.datetime.fromisoformat(record['modified']) >= since]
+    return records
+
+def page(records, query):
+    """limit/offset of a collection and the count rentman reports."""
+    limit = min(int(query.get('limit', MAX_LIMIT)), MAX_LIMIT)
+    offset = int(query.get('offset', 0))
+    return {'data': records[offset:offset + limit], 'itemCount': len(records), 'limit': limit, 'offset': offset}
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    # Set on the server: mock, latency, error_rate, retry_after, max_rps, stats, stats_lock, recent
+    protocol_version = 'HTTP/1.1'  # Keep-alive, like the real API
+
+    def log_message(self, format, *args):
+        pass  # Quiet, the benchmark prints its own report
+
+    def send_json(self, status, body, headers=None):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def count(self, key):
+        with self.server.stats_lock:
+            self.server.stats[key] = self.server.stats.get(key, 0) + 1
+
+    def too_many_requests(self):
+        """True if this API call gets a 429: by chance (error_rate) or above max_rps calls per second."""
+        if self.server.error_rate and random.random() < self.server.error_rate:
+            return True
+        if self.server.max_rps:
+            with self.server.stats_lock:
+                now = time.monotonic()
+                recent = self.server.recent
+                while recent and recent[0] < now - 1:
+                    recent.popleft()
+                if len(recent) >= self.server.max_rps:
+                    return True
+                recent.append(now)
+        return False
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(url.query))
+        if url.path.startswith('/blobs/'):
+            self.count('blob requests')
+            return self.send_blob(int(url.path.split('/')[2]))
+
+        self.count('api requests')
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        if not self.headers.get('Authorization', '').startswith('Bearer '):
+            return self.send_json(401, {'message': 'Unauthorized'})
+        if self.too_many_requests():
+            self.count('429 responses')
+            return self.send_json(429, {'message': 'Too many requests'}, {'Retry-After': str(self.server.retry_after)})
+
+        mock = self.server.mock
+        match = re.fullmatch(r'/equipment/(\d+)(/files)?', url.path)
+        if url.path == '/equipment':
+            records = modified_after(mock.equipment, query)
+            if 'code' in query:
+                records = [item for item in records if item['code'] == query['code']]
+            records = [{key: value for key, value in item.items() if key not in DETAIL_ONLY_FIELDS} for item in records]
+            if 'fields' in query:
+                fields = query['fields'].split(',')
+                records = [{key: mock.by_id[item['id']][key] for key in fields if key in mock.by_id[item['id']]} for item in records]
+            return self.send_json(200, page(records, query))
+        if match and int(match.group(1)) in mock.by_id:
+            equipment_id = int(match.group(1))
+            if match.group(2):
+                return self.send_json(200, {'data': [mock.file_record(file) for file in mock.files[equipment_id]]})
+            return self.send_json(200, {'data': mock.by_id[equipment_id]})
+        if url.path == '/files':
+            records = [mock.file_record(file) for files in mock.files.values() for file in files
+                       if query.get('itemtype', file.get('itemtype')) == file.get('itemtype')]
+            return self.send_json(200, page(records, query))
+        if url.path == '/contacts':
+            return self.send_json(200, page([], query))  # checkAuth.py
+        if url.path == '/folders':
+            return self.send_json(200, page(modified_after(list(mock.folders.values()), query), query))
+        match = re.fullmatch(r'/folders/(\d+)', url.path)
+        if match and int(match.group(1)) in mock.folders:
+            return self.send_json(200, {'data': mock.folders[int(match.group(1))]})
+        self.send_json(404, {'message': 'Not found'})
+
+    def do_HEAD(self):
+        url = urllib.parse.urlparse(self.path)
+        if not url.path.startswith('/blobs/'):
+            self.send_response(405)
+            self.send_header('Content-Length', '0')
+            return self.end_headers()
+        self.count('blob head requests')
+        self.send_blob(int(url.path.split('/')[2]), head_only=True)
+
+    def send_blob(self, file_id, head_only=False):
+        """A file like amazonS3 sends it: MD5 ETag, Range requests, HEAD without the content."""
+        content = self.server.mock.blobs.get(file_id)
+        if content is None:
+            return self.send_json(404, {'message': 'Not found'})
+        start = 0
+        range_header = re.fullmatch(r'bytes=(\d+)-', self.headers.get('Range', ''))
+        if range_header and int(range_header.group(1)) < len(content):
+            start = int(range_header.group(1))
+        self.send_response(206 if start else 200)
+        self.send_header('Content-Type', 'application/octet-stream')
+        self.send_header('Content-Length', str(len(content) - start))
+        self.send_header('ETag', f'"{hashlib.md5(content).hexdigest()}"')
+        if start:
+            self.send_header('Content-Range', f"bytes {start}-{len(content) - 1}/{len(content)}")
+        self.end_headers()
+        if head_only:
+            return
+        self.wfile.write(content[start:])
+        with self.server.stats_lock:
+            self.server.stats['blob bytes'] = self.server.stats.get('blob bytes', 0) + len(content) - start
+
+
+def start_server(mock, port=0, latency=0.0, error_rate=0.0, retry_after=1, max_rps=0):
+    """
+    Serve mock in a background thread. latency: seconds added to every API call,
+    error_rate: share of API calls answered with 429, max_rps: 429 above this many calls/second.
+    Returns the server; its base url is mock.base_url.
+    """
+    server = ThreadingHTTPServer(('127.0.0.1', port), MockHandler)
+    server.daemon_threads = True
+    server.mock = mock
+    server.latency = latency
+    server.error_rate = error_rate
+    server.retry_after = retry_after
+    server.max_rps = max_rps
+    server.stats = {}
+    server.stats_lock = threading.Lock()
+    server.recent = deque()
+    mock.base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the rentman API')
+    parser.add_argument('--items', type=int, help='Number of synthetic equipment articles', default=100)
+    parser.add_argument('--port', type=int, help='Port to listen on', default=8765)
+    parser.add_argument('--latency', type=float, help='Milliseconds added to every API call', default=0)
+    parser.add_argument('--error-rate', type=float, help='Share of API calls answered with 429 (0-1)', default=0)
+    parser.add_argument('--max-rps', type=int, help='Answer with 429 above this many API calls per second (0: no limit)', default=0)
+    args = parser.parse_args()
+
+    server = start_server(MockRentman(args.items), args.port, args.latency / 1000, args.error_rate, max_rps=args.max_rps)
+    print(f"Serving {args.items} articles on {server.mock.base_url} - use RENTMAN_BASE_URL={server.mock.base_url}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.shutdown()
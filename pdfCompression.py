@@ -0,0 +1,125 @@
+import hashlib
+import os
+import sqlite3
+import subprocess
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from exportState import STATE_DB
+
+# PDFs smaller than this are not worth a Ghostscript run (eg. sheets without images)
+COMPRESS_MIN_BYTES = 150 * 1024
+
+
+def compress_pdf(input_path, quality="screen"):
+    """
+    Compress PDF via Ghostscript.
+    quality: one of 'screen', 'ebook', 'printer', 'prepress', 'default'
+    Returns True if input_path was replaced by the compressed version, False if the
+    compressed version was not smaller and None if Ghostscript failed.
+    """
+    output_path = input_path + ".tmp.pdf"
+    command = [
+        "gs",
+        "-sDEVICE=pdfwrite",
+        "-dCompatibilityLevel=1.4",
+        f"-dPDFSETTINGS=/{quality}",
+        "-dNOPAUSE",
+        "-dQUIET",
+        "-dBATCH",
+        f"-sOutputFile={output_path}",
+        input_path,
+    ]
+
+    try:
+        subprocess.run(command, check=True)
+        if os.path.getsize(output_path) >= os.path.getsize(input_path):
+            os.remove(output_path)  # Ghostscript made it bigger, keep the original
+            return False
+        os.replace(output_path, input_path)
+        return True
+    except (subprocess.CalledProcessError, OSError) as e:
+        print(f"An error occurred while compressing the PDF (gs): {e}")
+        if os.path.exists(output_path):
+            os.remove(output_path)
+        return None
+
+def file_hash(path):
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def open_records():
+    # One short connection per call, this runs in the render processes
+    db = sqlite3.connect(STATE_DB, timeout=30)
+    columns = [column[1] for column in db.execute("PRAGMA table_info(compressed_pdfs)")]
+    if 'pdf_path' in columns:
+        db.execute("DROP TABLE compressed_pdfs")  # Keyed by path by an older version, never matched again
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS compressed_pdfs (
+            source_key TEXT PRIMARY KEY,
+            compressed_hash TEXT,
+            size_before INTEGER,
+            size_after INTEGER,
+            quality TEXT,
+            compressed_at TEXT
+        )
+    """)
+    return db
+
+def compressed_result(source_key, pdf_paths, quality="screen"):
+    """
+    The first of pdf_paths that is still the compressed PDF last made from source_key (eg. a hash of
+    the filled sheet html and its images), or None. Checked before rendering: WeasyPrint does not make
+    the same bytes twice, so a PDF rendered again can never be recognized by its own hash.
+    """
+    pdf_paths = [pdf_path for pdf_path in pdf_paths if pdf_path and os.path.isfile(pdf_path)]
+    if not pdf_paths:
+        return None
+    db = open_records()
+    try:
+        row = db.execute("SELECT compressed_hash FROM compressed_pdfs WHERE source_key = ? AND quality = ?", (source_key, quality)).fetchone()
+    finally:
+        db.close()
+    if row is None:
+        return None
+    return next((pdf_path for pdf_path in pdf_paths if file_hash(pdf_path) == row[0]), None)
+
+def compress_pdf_cached(pdf_path, quality="screen", source_key=None):
+    """
+    Compress a PDF, skipped if it is smaller than COMPRESS_MIN_BYTES.
+    With source_key, the result is recorded for compressed_result(), so the next time the same
+    source does not need to be rendered or compressed again.
+    Records the size before and after. Returns a dict with path, size_before, size_after and status.
+    """
+    if not os.path.isfile(pdf_path):
+        return {'path': pdf_path, 'size_before': 0, 'size_after': 0, 'status': 'missing'}
+    size_before = os.path.getsize(pdf_path)
+    result = {'path': pdf_path, 'size_before': size_before, 'size_after': size_before}
+    if size_before < COMPRESS_MIN_BYTES:
+        status = 'small'
+    else:
+        compressed = compress_pdf(pdf_path, quality)
+        if compressed is None:
+            return dict(result, status='failed')  # Not recorded, tried again next time
+        status = 'compressed' if compressed else 'not smaller'
+
+    size_after = os.path.getsize(pdf_path)
+    if source_key:
+        db = open_records()
+        try:
+            db.execute(
+                "INSERT OR REPLACE INTO compressed_pdfs (source_key, compressed_hash, size_before, size_after, quality, compressed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (source_key, file_hash(pdf_path), size_before, size_after, quality, datetime.datetime.now().isoformat(timespec='seconds'))
+            )
+            db.commit()
+        finally:
+            db.close()
+    return dict(result, size_after=size_after, status=status)
+
+def compress_pdfs(pdf_paths, quality="screen", workers=4, source_keys=None):
+    """Compress several PDFs at the same time (Ghostscript runs as separate processes)."""
+    source_keys = source_keys or [None] * len(pdf_paths)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(lambda job: compress_pdf_cached(job[0], quality, job[1]), zip(pdf_paths, source_keys)))
@@ -0,0 +1,181 @@
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import tarfile
+import zipfile
+from blobCache import link_or_copy
+from exportState import STATE_DB
+from itemStaging import remove_empty_parents
+
+# Publish "equipmentDump" (eg. to Dropbox or a backup disk) without copying everything and deleting
+# what is not wanted afterwards (clean_for_dropbox.sh). Only files with an allowed extension are published:
+#   tree      the same folders, the files hardlinked (reflinked, or copied on another file system)
+#   zip, tar  one archive per category with the folders of its equipment, eg. "Möbel/Sessel.zip"
+# Only what changed since the last publish to the same target is linked or written again, see the
+# table "published" in exportState.sqlite:
+#   python3 publishExport.py ~/Dropbox/equipment --format zip
+
+# Like clean_for_dropbox.sh: everything else (data.json, data.md, QR codes, ..) stays behind
+PUBLISH_EXTENSIONS = ('pdf', 'jpg', 'png')
+PUBLISH_FORMATS = ('tree', 'zip', 'tar')
+# Archive of the equipment that is not in a category
+UNCATEGORIZED_ARCHIVE = '_uncategorized'
+
+
+def open_records():
+    # One short connection per publish, like the records of pdfCompression.py
+    db = sqlite3.connect(STATE_DB, timeout=30)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS published (
+            target TEXT,
+            path TEXT,
+            archive TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            published_at TEXT,
+            PRIMARY KEY (target, path)
+        )
+    """)
+    return db
+
+def has_extension(filename, extensions):
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in extensions
+
+def archive_name(path, publish_format):
+    """Archive a file is published in: the category of its equipment folder, '' in a tree."""
+    if publish_format == 'tree':
+        return ''
+    category = os.path.dirname(os.path.dirname(path))  # Above the equipment folder
+    return f"{category or UNCATEGORIZED_ARCHIVE}.{publish_format}"
+
+def find_files(root_folder, extensions, publish_format):
+    """{path relative to root_folder: (size, mtime_ns, archive)} of every file to publish."""
+    files = {}
+    for dirpath, dirnames, filenames in os.walk(root_folder):
+        dirnames[:] = sorted(dirname for dirname in dirnames if not dirname.startswith('.'))  # Not .staging or .trash
+        for filename in filenames:
+            if not has_extension(filename, extensions):
+                continue
+            stat = os.stat(os.path.join(dirpath, filename))
+            path = os.path.relpath(os.path.join(dirpath, filename), root_folder)
+            files[path] = (stat.st_size, stat.st_mtime_ns, archive_name(path, publish_format))
+    return files
+
+def group_by_archive(files):
+    """{archive: {path: (size, mtime_ns)}} of the files that are published in an archive."""
+    archives = {}
+    for path, (size, mtime_ns, archive) in files.items():
+        if archive:
+            archives.setdefault(archive, {})[path] = (size, mtime_ns)
+    return archives
+
+def write_archive(archive_path, root_folder, entries):
+    """
+    Write the files (paths relative to root_folder) into a new zip or tar archive, read straight from
+    root_folder. Stored uncompressed: PDFs and images hardly get smaller, and it is much faster.
+    The archive is replaced when it is complete, a sync client never sees half of it.
+    """
+    tmp_path = f"{archive_path}.tmp"
+    os.makedirs(os.path.dirname(archive_path), exist_ok=True)
+    if archive_path.endswith('.zip'):
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as archive:
+            for path in sorted(entries):
+                archive.write(os.path.join(root_folder, path), arcname=archive_entry_name(path))
+    else:
+        with tarfile.open(tmp_path, 'w') as archive:
+            for path in sorted(entries):
+                archive.add(os.path.join(root_folder, path), arcname=archive_entry_name(path), recursive=False)
+    os.replace(tmp_path, archive_path)
+
+def archive_entry_name(path):
+    """Name inside the archive of its category: "<equipment folder>/<file>"."""
+    return os.path.join(os.path.basename(os.path.dirname(path)), os.path.basename(path))
+
+def remove_published(path, target):
+    if os.path.isfile(path):
+        os.remove(path)
+    remove_empty_parents(path, target)
+
+def publish_export(root_folder, target, publish_format='tree', extensions=PUBLISH_EXTENSIONS):
+    """
+    Bring target up to date with the files in root_folder that have one of the extensions.
+    Files whose size and modification time did not change since the last publish to target are
+    neither linked nor written again; an archive is only written again if one of its files changed,
+    was added or removed. Files and archives that are gone from root_folder are removed from target.
+    Returns the numbers of 'linked' files, 'archives' written, 'removed' files or archives and 'unchanged' files.
+    """
+    if os.path.realpath(target).startswith(os.path.realpath(root_folder) + os.sep):
+        raise ValueError(f"The target '{target}' must not be inside '{root_folder}'")
+    extensions = tuple(extension.strip().lower().lstrip('.') for extension in extensions)
+    stats = {'linked': 0, 'archives': 0, 'removed': 0, 'unchanged': 0}
+    files = find_files(root_folder, extensions, publish_format)
+    db = open_records()
+    try:
+        previous = {row[0]: (row[1], row[2], row[3]) for row in
+                    db.execute("SELECT path, size, mtime_ns, archive FROM published WHERE target = ?", (target,))}
+
+        # Tree: one link per file
+        for path, (size, mtime_ns, archive) in files.items():
+            if archive:
+                continue
+            target_path = os.path.join(target, path)
+            if previous.get(path) == (size, mtime_ns, '') and os.path.isfile(target_path):
+                stats['unchanged'] += 1
+                continue
+            os.makedirs(os.path.dirname(target_path), exist_ok=True)
+            link_or_copy(os.path.join(root_folder, path), target_path)
+            stats['linked'] += 1
+        for path, (_, _, archive) in previous.items():
+            if not archive and (path not in files or files[path][2]):
+                remove_published(os.path.join(target, path), target)
+                stats['removed'] += 1
+
+        # Archives: one per category, written again as a whole if anything in it changed
+        archives = group_by_archive(files)
+        previous_archives = group_by_archive(previous)
+        for archive, entries in sorted(archives.items()):
+            if entries == previous_archives.get(archive) and os.path.isfile(os.path.join(target, archive)):
+                stats['unchanged'] += len(entries)
+                continue
+            write_archive(os.path.join(target, archive), root_folder, entries)
+            stats['archives'] += 1
+        for archive in previous_archives.keys() - archives.keys():
+            remove_published(os.path.join(target, archive), target)
+            stats['removed'] += 1
+
+        published_at = datetime.datetime.now().isoformat(timespec='seconds')
+        with db:
+            db.execute("DELETE FROM published WHERE target = ?", (target,))
+            db.executemany(
+                "INSERT INTO published (target, path, archive, size, mtime_ns, published_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [(target, path, archive, size, mtime_ns, published_at) for path, (size, mtime_ns, archive) in files.items()]
+            )
+    finally:
+        db.close()
+    return stats
+
+def print_publish_stats(target, stats):
+    print(f"Published to '{target}': {stats['linked']} files linked, {stats['archives']} archives written, "
+          f"{stats['removed']} removed, {stats['unchanged']} files unchanged")
+
+
+# Main script
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Publish the PDFs and images of equipmentDump to a folder, as a tree of links or archives per category')
+    parser.add_argument('target', type=str, help='Folder to publish to, eg. in Dropbox')
+    parser.add_argument('--format', choices=PUBLISH_FORMATS, help='tree: folders with links to the files, zip/tar: one archive per category', default='tree')
+    parser.add_argument('--extensions', type=str, help='Comma-separated extensions of the files to publish', default=','.join(PUBLISH_EXTENSIONS))
+    parser.add_argument('--source', type=str, help='Folder of the export', default='equipmentDump')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.source):
+        print(f"Error: Folder '{args.source}' does not exist.")
+        sys.exit(1)
+    try:
+        stats = publish_export(args.source, args.target, args.format, [extension for extension in args.extensions.split(',') if extension.strip()])
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+    print_publish_stats(args.target, stats)
@@ -0,0 +1,72 @@
+import hashlib
+import os
+
+# Lives next to the "equipmentDump" folder; every QR code is encoded only once and linked into the equipment folders
+QR_CACHE_DIR = 'qrCodes'
+
+QR_SETTINGS = {
+    'version': 1,
+    'error_correction': 2,  # qrcode.constants.ERROR_CORRECT_H: high error correction level (qrcode is imported when needed)
+    'box_size': 10,
+    'border': 4,
+}
+
+
+def generate_qr_code(qr_path, number, settings=QR_SETTINGS):
+    """
+    Generates a QR code SVG image for the provided number.
+
+    Args:
+    qr_path (str): The file path where the QR code SVG will be saved.
+    number (str): The number to encode in the QR code.
+    settings (dict): version, error correction, box size and border of the QR code.
+
+    Returns:
+    None. Saves the QR code image as an SVG file.
+    """
+    import qrcode  # Only needed when a QR code is not in the store yet
+    import qrcode.image.svg
+
+    # Set the factory to create an SVG image
+    svg_factory = qrcode.image.svg.SvgPathImage
+
+    # Create a QRCode object with SVG support
+    qr = qrcode.QRCode(
+        version=settings['version'],  # Controls the size of the QR Code
+        error_correction=settings['error_correction'],
+        box_size=settings['box_size'],
+        border=settings['border'],
+        image_factory=svg_factory
+    )
+
+    # Add data to the QR Code
+    qr.add_data(number)
+    qr.make(fit=True)
+
+    # Create an SVG image from the QR Code instance
+    img = qr.make_image(fill_color="black", back_color="white")
+
+    # Save the SVG image to the specified path
+    img.save(qr_path)
+    #print(f"QR code generated and saved at '{qr_path}'.")
+
+def qr_code_path(value, settings=QR_SETTINGS):
+    """Path of the QR code of value in the store, keyed by the value and the rendering settings."""
+    key = hashlib.sha1(f"{value}|{sorted(settings.items())}".encode()).hexdigest()
+    return os.path.join(QR_CACHE_DIR, key[:2], f"{key}.svg")
+
+def get_qr_codes(values, settings=QR_SETTINGS):
+    """
+    QR codes of all values (eg. all serial numbers of an item or of a whole run) as {value: svg path}.
+    Only values that were never encoded with these settings are encoded now.
+    """
+    qr_codes = {}
+    for value in dict.fromkeys(values):  # Without duplicates, in order
+        path = qr_code_path(value, settings)
+        if not os.path.isfile(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp.svg"
+            generate_qr_code(tmp_path, value, settings)
+            os.replace(tmp_path, path)
+        qr_codes[value] = path
+    return qr_codes
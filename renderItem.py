@@ -0,0 +1,353 @@
+import os
+import re
+import json
+import hashlib
+import pathlib
+import urllib.parse
+import contextlib
+import datetime
+import shutil
+from imageDerivatives import make_derivatives
+from pdfCompression import compress_pdf_cached, compress_pdfs, compressed_result
+from qrCache import get_qr_codes
+from blobCache import link_or_copy
+from runMetrics import timed
+# pypandoc and weasyprint (also via sheetRenderer) are imported when their output is made,
+# so runs without PDFs or sheets neither load nor need them
+
+# Everything render_item can make; data.json and the downloaded files are made by collectEverything.py
+RENDER_OUTPUTS = ('md', 'pdf', 'qr', 'sheet')
+
+# Options of the render stage, set from the command line arguments of collectEverything.py
+RENDER_OPTIONS = {
+    'verbose': False,
+    'pdf_engine': 'pandoc',        # Converter for data.md: 'pandoc' (LaTeX) or 'weasyprint' (in-process)
+    'image_derivatives': True,     # Use downscaled copies of the images in the PDFs, the originals stay untouched
+    'compress': True,              # Ghostscript pass over the sheet PDFs
+    'outputs': RENDER_OUTPUTS,     # Which of RENDER_OUTPUTS to make, see with_required_outputs
+}
+
+def with_required_outputs(outputs):
+    """Add the outputs the given ones are made from: the PDF is made from data.md, the sheet shows the QR codes."""
+    outputs = set(outputs)
+    if 'pdf' in outputs:
+        outputs.add('md')
+    if 'sheet' in outputs:
+        outputs.add('qr')
+    return outputs
+
+# Caveat: "Custom fields are not queryable." (https://api.rentman.net/#section/Introduction/Custom-fields)
+extra_input_fields = {
+    "custom_1": "Artikelbeschreibung in Englisch",
+    "custom_4": "Bemerkung an Mieter\\*in",
+    "custom_7": "Baujahr",
+    "custom_8": "Kategorie"
+}
+
+def load_file_content(file_path):
+    try:
+        with open(file_path, 'r') as file:
+            return file.read().strip()  # Read the token and strip any extra whitespace
+    except FileNotFoundError:
+        print(f"The file '{file_path}' was not found.")
+        return None
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        return None
+    
+def convert_md_to_pdf(md_file_path, output_pdf_path, resource_path, image_paths=None):
+    """image_paths: {local path: absolute path} of images to embed instead of the originals (eg. downscaled copies)."""
+    try:
+        import pypandoc  # Only needed for this PDF engine
+        with open(md_file_path, 'r') as f:
+            md_content = f.read()
+        # Only the embedded images, the links still point to the originals
+        for local_path, image_path in (image_paths or {}).items():
+            md_content = md_content.replace(f"![File](<./{local_path}>)", f"![File](<{image_path}>)")
+        # Convert markdown to PDF using Pandoc
+        pypandoc.convert_text(md_content, 'pdf', format='md', outputfile=output_pdf_path, extra_args=(["-V", "papersize:a4", "-V", "geometry:margin=1.5cm", f"--resource-path={resource_path}", "--embed-resources", "--standalone"]))
+    except Exception as e:
+        print("\nAn error occurred while generating PDF; skipping:", e)
+
+# Same page setup as the pandoc/LaTeX PDF: A4 with 1.5cm margins
+MD_PDF_CSS = """
+    @page { size: A4; margin: 1.5cm; }
+    body { font-family: Helvetica, Arial, sans-serif; font-size: 11pt; line-height: 1.35; }
+    h1 { font-size: 20pt; }
+    h2 { font-size: 15pt; margin-top: 1.5em; }
+    img { max-width: 100%; max-height: 22cm; }
+    a { color: #1a4d8f; word-break: break-all; }
+    blockquote { margin-left: 1em; padding-left: 1em; border-left: 3px solid #ccc; }
+"""
+
+def convert_md_to_pdf_weasyprint(md_file_path, output_pdf_path, resource_path, image_urls=None):
+    """
+    Convert markdown to PDF in this process: markdown => HTML (python-markdown) => PDF (WeasyPrint).
+    Much faster than starting pandoc and LaTeX for every item and needs no BasicTeX.
+    image_urls: {local path: url} of images to show instead of the originals (eg. downscaled copies).
+    """
+    try:
+        import markdown  # Only needed for this PDF engine
+        from weasyprint import HTML, CSS
+        with open(md_file_path, 'r') as f:
+            md_content = f.read()
+        # python-markdown needs 4 spaces to nest lists, data.md uses 2
+        md_content = re.sub(r'^  - ', '    - ', md_content, flags=re.MULTILINE)
+        html_content = markdown.markdown(md_content, extensions=['extra'])
+        for local_path, url in (image_urls or {}).items():
+            html_content = html_content.replace(f'src="./{local_path}"', f'src="{url}"')
+        with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+            HTML(string=f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"></head><body>{html_content}</body></html>",
+                 base_url=os.path.abspath(resource_path) + os.sep).write_pdf(output_pdf_path, stylesheets=[CSS(string=MD_PDF_CSS)])
+    except Exception as e:
+        print("\nAn error occurred while generating PDF; skipping:", e)
+
+def render_item(item, folder_path, eq_name, files_list, options=RENDER_OPTIONS, batch_sheets=False, exported_folder=None):
+    """
+    Create data.md, the PDF, the QR codes and the equipment sheet of one equipment
+    from its data and the already downloaded files (only the ones in options['outputs']).
+    Runs in a worker process of the render pool, so it only gets plain data.
+    With batch_sheets the sheet PDF is not rendered; the sheet is returned for render_items_batch
+    (None without the 'sheet' output).
+    exported_folder: the previous export of the equipment, its sheet PDF is reused if nothing on it changed.
+    """
+    verbose = options['verbose']
+    outputs = options['outputs']
+
+    # Create markdown file with all data
+    md_content = f"[Ça Tourne Requisit](https://www.catourne.ch)\n\n"
+    md_content += f"# {item.get('name', 'Unknown')}"
+    if(item.get('in_archive')):
+        md_content += f" *(Archiviert)*"
+    md_content += "\n\nKategorie: › "
+    category_path_list = f"{item.get('folder_path', 'Unknown').replace('/', ' › ')}\n\n"
+    md_content += category_path_list
+    md_content += "\n\n"
+    md_content += "## Details\n"
+    for key, value in item.items():
+        if(key == "custom"):
+            # Show "EXTRA INPUT FIELDS" in a special way
+            md_content += f"- **Extra Input Fields ('custom')**:\n"
+            for subKey, subValue in value.items():
+                md_content += f"  - *{extra_input_fields.get(subKey, subKey)}*: {subValue}\n"
+        else:
+            md_content += f"- **{key}**: {value}\n"
+    md_content += f"\n## Files ({len(files_list)})\n"
+    image_list = []
+    for file in files_list:
+        if(file["data"]["type"].startswith("image/")):
+            image_list.append(file['local_path'])
+            md_content += f"![File](<./{file['local_path']}>)\nLocal Image: [{file['filename']}](<./{file['local_path']}>) | <sub><sup>[*Original URL*]({file['original_url']})</sup></sub><br><br>\n\n\n"
+        elif(file['filename'].endswith('.txt') or file['filename'].endswith('.rtf') or file['filename'].endswith('.TXT') or file['filename'].endswith('.RTF')):
+            file_contents = load_file_content(os.path.join(folder_path, file['filename']))
+            md_content += f"Local File: [{file['filename']}](<./{file['local_path']}>) - Content:\n\n> {file_contents}\n\n<sub><sup>[*Original URL*]({file['original_url']})</sup></sub><br><br>\n\n\n"
+        else:
+            md_content += f"Local File: [{file['filename']}](<./{file['local_path']}>) | <sub><sup>[*Original URL*]({file['original_url']})</sup></sub><br><br>\n\n\n"
+
+    if(len(files_list) == 0):
+        md_content += f"\n#### *No files for this document.*\n\n"
+    
+    
+    md_content += f"\n---\n"
+    current_datetime = datetime.datetime.now()
+    formatted_date = current_datetime.strftime('%d.%m.%Y - %H:%M')
+    md_content += f"<br><br><sub><sup>Export Date: {formatted_date}</sub></sup>\n"
+
+    md_file_path = os.path.join(folder_path, 'data.md')
+    if('md' in outputs):
+        with timed('markdown'), open(md_file_path, 'w') as f:
+            f.write(md_content)
+        if(verbose):
+            print(f"   Created .MD file:   {md_file_path}")
+
+    # Downscaled copies of the images for the PDFs, made once and cached
+    image_paths = image_urls = None
+    if(options['image_derivatives'] and ('pdf' in outputs or 'sheet' in outputs)):
+        # Keyed by rentman file id and "modified", the same image is only downscaled once
+        source_keys = {os.path.join(folder_path, file['local_path']): f"{file['data']['id']}|{file['data'].get('modified')}"
+                       for file in files_list if file['local_path'] in image_list}
+        with timed('images'):
+            derivatives = make_derivatives([os.path.join(folder_path, local_path) for local_path in image_list], source_keys=source_keys)
+        image_paths = {local_path: derivatives[os.path.join(folder_path, local_path)] for local_path in image_list}
+        image_urls = {local_path: pathlib.Path(image_path).as_uri() for local_path, image_path in image_paths.items()}
+
+    # Convert .md to .PDF
+    if('pdf' in outputs):
+        pdf_path = os.path.join(folder_path, f"{eq_name}.pdf")
+        if(options['pdf_engine'] == "weasyprint"):
+            with timed('md weasyprint'):
+                convert_md_to_pdf_weasyprint(md_file_path, pdf_path, folder_path, image_urls)
+        else:
+            with timed('pandoc'):
+                convert_md_to_pdf(md_file_path, pdf_path, folder_path, image_paths)
+        # compress_pdf(pdf_path, 125, 5)
+
+        if(verbose):
+            print(f"   Created .PDF file:  {pdf_path}")
+
+    # Create QRCODE svg from euqipment serial number
+    serial_numbers = [num.strip() for num in item['qrcodes_of_serial_numbers'].split(",") if num.strip()]
+    if('qr' in outputs):
+        # Encoded once per serial number and linked from the shared QR code store
+        with timed('qr'):
+            qr_codes = get_qr_codes(serial_numbers)
+            for number in serial_numbers:
+                qr_path = os.path.join(folder_path, f"{eq_name}-{number}-qr.svg")
+                if(not os.path.isfile(qr_path) or not os.path.samefile(qr_path, qr_codes[number])):
+                    link_or_copy(qr_codes[number], qr_path)
+                if(verbose):
+                    print(f"   Created QR code:  {number}")
+
+    if('sheet' not in outputs):
+        return None
+
+    # Make equipment sheet html from the template equipment-sheet.html (read and parsed once per process)
+    from sheetRenderer import get_sheet_renderer  # Loads weasyprint
+    sheet_renderer = get_sheet_renderer()
+    html_path = os.path.join(folder_path, f"{eq_name}-sheet.html")
+    with timed('sheet html'), open(html_path, 'w') as file:
+        html = sheet_renderer.fill(sheet_values(item, files_list, image_list, category_path_list, serial_numbers, eq_name))
+        file.write(html)
+    if(verbose):
+        print(f"   Created .HTML equipment sheet file:  {html_path}")
+
+    sheet = {
+        'code': item['code'],
+        'folder_path': folder_path,
+        'pdf_path': os.path.join(folder_path, f"{eq_name}-sheet.pdf"),
+        # Copy PDF to one folder for easy access if not in archive;
+        # ignore sheets without any images OR qr codes
+        'collected_path': os.path.join("equipmentSheets", f"{eq_name}-sheet.pdf") if (not item.get('in_archive') and (len(image_list) > 0 or len(serial_numbers) > 0)) else None,
+        'source_key': sheet_source_key(html, files_list, image_list, options),
+        'reused': False,
+    }
+    if(options['compress']):
+        # Nothing on the sheet changed since it was last rendered and compressed: no WeasyPrint, no Ghostscript
+        with timed('sheet reuse'):
+            sheet['reused'] = reuse_sheet(sheet, exported_folder)
+        if(sheet['reused']):
+            if(verbose):
+                print(f"   Sheet unchanged, reused:  {sheet['pdf_path']}")
+            if(not batch_sheets):
+                collect_sheet(sheet, verbose)
+            return sheet if batch_sheets else None
+    if(batch_sheets):
+        # Absolute urls, the sheet is laid out together with sheets of other folders
+        folder_url = pathlib.Path(folder_path).absolute().as_uri() + '/'
+        sheet['values'] = sheet_values(item, files_list, image_list, category_path_list, serial_numbers, eq_name, folder_url, image_urls)
+        return sheet
+
+    # Make equipment sheet pdf
+    with timed('weasyprint'):
+        sheet_renderer.write_pdf(sheet_values(item, files_list, image_list, category_path_list, serial_numbers, eq_name, image_urls=image_urls), folder_path, sheet['pdf_path'])
+    if(verbose):
+        print(f"   Created .PDF from equipment sheet .html file:  {sheet['pdf_path']}")
+    finish_sheet(sheet, options)
+
+
+def missing_outputs(folder_path, eq_name, outputs=RENDER_OUTPUTS):
+    """Files that render_item failed to create (pandoc and WeasyPrint only print their errors)."""
+    files = {'md': ['data.md'], 'pdf': [f"{eq_name}.pdf"], 'sheet': [f"{eq_name}-sheet.html", f"{eq_name}-sheet.pdf"]}
+    return [file for output in outputs for file in files.get(output, []) if not os.path.isfile(os.path.join(folder_path, file))]
+
+def sheet_values(item, files_list, image_list, category_path_list, serial_numbers, eq_name, url_prefix='', image_urls=None):
+    """
+    Values for the %%placeholders%% in equipment-sheet.html:
+        %%name%% => item['displayname']
+        %%img%% => the image that is set as poster image by rentman user
+        %%categories%% => category_path_list
+        %%amount%% => len(serial_numbers)
+        %%code%% => item['code']
+        %%length%% => item['length']
+        %%width%% => item['width']
+        %%height%% => item['height']
+        %%qr_codes%% => one <div> per serial number
+    Files are linked relative to the sheet, or as url_prefix + file name if given.
+    image_urls: {local path: url} of images to use instead of the originals (eg. downscaled copies).
+    """
+    def file_url(filename):
+        return url_prefix + urllib.parse.quote(filename) if url_prefix else filename
+
+    values = {
+        'name': item['displayname'],
+        'categories': category_path_list,
+        'amount': str(len(serial_numbers)),
+        'code': item['code'],
+        'length': str(item['length']),
+        'width': str(item['width']),
+        'height': str(item['height']),
+        'qr_codes': ''.join(f'<div class="qr"><img src="{file_url(f"{eq_name}-{number}-qr.svg")}" alt=""> {number}</div>\n        ' for number in serial_numbers),
+    }
+    # Choose image that is set as poster image by rentman user
+    if(item['image'] and len(image_list) > 0 and len(item['image']) > 0):
+        poster = int(os.path.basename(item['image']))
+        for img in files_list:
+            if poster == img["data"]["id"]:
+                values['img'] = (image_urls or {}).get(img["local_path"]) or file_url(img["local_path"])
+    return values
+
+def sheet_source_key(html, files_list, image_list, options=RENDER_OPTIONS):
+    """Everything the sheet PDF is made from: the filled html (with the template) and the versions of its images."""
+    images = sorted((file['data']['id'], file['data'].get('modified')) for file in files_list if file['local_path'] in image_list)
+    source = json.dumps([html, images, options['image_derivatives']])
+    return hashlib.sha256(source.encode()).hexdigest()
+
+def reuse_sheet(sheet, exported_folder=None):
+    """
+    True if the compressed sheet PDF of the same source_key is still in the folder (render-only)
+    or in the previous export; it is linked to sheet['pdf_path'].
+    """
+    candidates = [sheet['pdf_path']]
+    if(exported_folder):
+        candidates.append(os.path.join(exported_folder, os.path.basename(sheet['pdf_path'])))
+    previous = compressed_result(sheet['source_key'], candidates, "screen")
+    if previous is None:
+        return False
+    if previous != sheet['pdf_path']:
+        link_or_copy(previous, sheet['pdf_path'])
+    return True
+
+def finish_sheet(sheet, options=RENDER_OPTIONS):
+    """Reduce the file size of a rendered sheet PDF and copy it to equipmentSheets."""
+    if(options['compress']):
+        with timed('gs'):
+            result = compress_pdf_cached(sheet['pdf_path'], "screen", sheet['source_key'])
+        print_compression(result, options['verbose'])
+    collect_sheet(sheet, options['verbose'])
+
+def print_compression(result, verbose):
+    if(verbose):
+        print(f"   - Resized .PDF ({result['status']}): {result['size_before'] // 1024} KB => {result['size_after'] // 1024} KB")
+
+def collect_sheet(sheet, verbose=False):
+    """Copy the sheet PDF to equipmentSheets (only sheets that are not archived and have images or QR codes)."""
+    if(sheet['collected_path']):
+        try:
+            with timed('copy'):
+                shutil.copyfile(sheet['pdf_path'], sheet['collected_path'])
+            if(verbose):
+                print(f"   - Copied .PDF to {sheet['collected_path']}")
+        except Exception as e:
+            print(f"   - An error occurred: {e} - Maybe folder 'equipmentSheets' in root is missing?")
+
+def render_items_batch(jobs, options=RENDER_OPTIONS):
+    """
+    Render several items, laying out all their sheets in one WeasyPrint document.
+    jobs: list of (item, folder_path, eq_name, files_list), the arguments of render_item.
+    """
+    sheets = [sheet for sheet in (render_item(*job, options, batch_sheets=True) for job in jobs) if sheet]
+    rendered = [sheet for sheet in sheets if not sheet['reused']]
+    if rendered:
+        from sheetRenderer import get_sheet_renderer
+        with timed('weasyprint batch'):
+            get_sheet_renderer().render_batch([(sheet['values'], sheet['pdf_path']) for sheet in rendered])
+    if(rendered and options['compress']):
+        # Ghostscript for all sheets of the batch at once
+        with timed('gs batch'):
+            results = compress_pdfs([sheet['pdf_path'] for sheet in rendered], "screen", source_keys=[sheet['source_key'] for sheet in rendered])
+        for result in results:
+            print_compression(result, options['verbose'])
+    for sheet in sheets:
+        if(options['verbose'] and not sheet['reused']):
+            print(f"   Created .PDF from equipment sheet of '{sheet['code']}':  {sheet['pdf_path']}")
+        collect_sheet(sheet, options['verbose'])
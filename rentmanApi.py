@@ -0,0 +1,282 @@
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+import email.utils
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import runMetrics
+
+# Constants for the API endpoints
+# RENTMAN_BASE_URL points the scripts to another server, eg. mockRentmanApi.py for benchmarks
+BASE_URL = os.environ.get('RENTMAN_BASE_URL', 'https://api.rentman.net').rstrip('/')
+
+# Rentman API does not allow more than 20 requests per second
+MAX_REQUESTS_PER_SECOND = 20
+
+# Adaptive rate (see AdaptiveRateLimiter): start at half the limit, go up by
+# RATE_INCREASE requests/second every second without throttling, halve it on a 429
+START_REQUESTS_PER_SECOND = MAX_REQUESTS_PER_SECOND / 2
+MIN_REQUESTS_PER_SECOND = 1
+RATE_INCREASE = 2.0
+RATE_DECREASE_FACTOR = 0.5
+LATENCY_FACTOR = 3  # Do not go faster while calls take this many times longer than the fastest ones
+THROTTLE_STATUS_CODES = (429, 503)
+
+# Retry settings for 429, 5xx and connection errors
+MAX_RETRIES = 6
+BACKOFF_BASE = 0.5  # Seconds, doubled on every attempt
+BACKOFF_MAX = 30    # Seconds, never wait longer than this between attempts
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+REQUEST_TIMEOUT = (10, 60)  # Connect and read timeout in seconds
+
+# Pages of a collection fetched at the same time when listing (see api_list)
+LIST_PAGE_WORKERS = 4
+
+
+class TokenBucket:
+    """
+    Thread safe token bucket. Every call to acquire() takes one token and blocks
+    until one is available. Tokens refill at `rate` per second up to `capacity`.
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        started = time.monotonic()
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.last_refill) * self.rate)
+                self.last_refill = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    break
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+        if now > started:
+            runMetrics.count('rate_limit_wait_seconds', now - started)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """
+    Token bucket whose rate follows the feedback of the API (AIMD, like TCP congestion control):
+    - every call that is not throttled adds a little, RATE_INCREASE requests/second per second,
+      up to max_rate; not while the latency is much higher than usual (the API is struggling)
+      or the API reports that no calls are remaining (X-RateLimit-Remaining)
+    - a 429 (or 503) halves the rate, at most once a second because the calls that were
+      already on their way come back throttled too, and pauses all threads for Retry-After
+    """
+    def __init__(self, max_rate, start_rate=None, min_rate=MIN_REQUESTS_PER_SECOND):
+        super().__init__(start_rate or max_rate, capacity=1)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.paused_until = 0.0
+        self.last_decrease = 0.0
+        self.fastest_latency = {}  # Per endpoint, a list page takes longer than one equipment
+        self.latency = {}          # Per endpoint, moving average
+
+    def acquire(self):
+        with self.lock:
+            pause = self.paused_until - time.monotonic()
+        if pause > 0:
+            runMetrics.count('rate_limit_wait_seconds', pause)
+            time.sleep(pause)
+        super().acquire()
+
+    def on_response(self, response, latency, endpoint=''):
+        """Feedback of one rate limited call (response None: connection failed)."""
+        with self.lock:
+            if response is not None and response.status_code in THROTTLE_STATUS_CODES:
+                now = time.monotonic()
+                retry_after = retry_after_seconds(response)
+                if retry_after:
+                    self.paused_until = max(self.paused_until, now + retry_after)
+                if now - self.last_decrease >= 1:
+                    self.rate = max(self.min_rate, self.rate * RATE_DECREASE_FACTOR)
+                    self.last_decrease = now
+                    runMetrics.count('rate_limit_decreases')
+                return
+            if response is None:
+                return
+            self.fastest_latency[endpoint] = min(self.fastest_latency.get(endpoint, latency), latency)
+            self.latency[endpoint] = 0.9 * self.latency.get(endpoint, latency) + 0.1 * latency
+            if self.latency[endpoint] > LATENCY_FACTOR * self.fastest_latency[endpoint]:
+                return
+            if response.headers.get('X-RateLimit-Remaining', '').strip() in ('0', '1'):
+                return
+            self.rate = min(self.max_rate, self.rate + RATE_INCREASE / self.rate)
+
+
+# One bucket for the whole process: every call to api.rentman.net goes through here,
+# no matter how many worker threads are exporting at the same time.
+# Capacity of 1 spreads the calls evenly instead of bursting 20 at once.
+rate_limiter = AdaptiveRateLimiter(MAX_REQUESTS_PER_SECOND, start_rate=START_REQUESTS_PER_SECOND)
+
+# One session for the whole process, keeps the TLS connections alive between calls
+session = requests.Session()
+session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+session.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=32))
+
+# Per endpoint counters, eg. {'/equipment/{id}/files': {'requests': 812, 'retries': 3, 'errors': 0, 'seconds': 97.3}}
+endpoint_stats = {}
+stats_lock = threading.Lock()
+
+
+def endpoint_name(url):
+    """Group urls by endpoint: '/equipment/722/files' => '/equipment/{id}/files', S3 urls by host."""
+    parsed = urllib.parse.urlparse(url)
+    if not url.startswith(BASE_URL):
+        return parsed.netloc
+    return re.sub(r'/\d+', '/{id}', parsed.path) or '/'
+
+def count_request(endpoint, key, value=1):
+    with stats_lock:
+        stats = endpoint_stats.setdefault(endpoint, {'requests': 0, 'retries': 0, 'errors': 0, 'seconds': 0.0})
+        stats[key] += value
+
+def retry_after_seconds(response):
+    """Read the Retry-After header (seconds or HTTP date), None if missing."""
+    value = response.headers.get('Retry-After') if response is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+        return max(0.0, retry_at.timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_seconds(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+def get_with_retry(url, headers=None, params=None, rate_limited=True, stream=False, method='GET'):
+    """
+    GET (or HEAD ..) an url via the shared session. Retries connection errors, 429 and 5xx with
+    jittered exponential backoff and honors Retry-After. Returns the last response;
+    raises the last connection error if all attempts failed.
+    """
+    endpoint = endpoint_name(url)
+    for attempt in range(MAX_RETRIES + 1):
+        if rate_limited:
+            rate_limiter.acquire()
+        count_request(endpoint, 'requests')
+        started = time.monotonic()
+        response = None
+        try:
+            response = session.request(method, url, headers=headers, params=params, stream=stream, timeout=REQUEST_TIMEOUT)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+            if attempt == MAX_RETRIES:
+                count_request(endpoint, 'errors')
+                raise
+        finally:
+            latency = time.monotonic() - started
+            count_request(endpoint, 'seconds', latency)
+            runMetrics.record_latency(endpoint, latency)
+        if rate_limited:
+            rate_limiter.on_response(response, latency, endpoint)
+
+        if response is not None and response.status_code not in RETRY_STATUS_CODES:
+            return response
+        if response is not None and attempt == MAX_RETRIES:
+            count_request(endpoint, 'errors')
+            return response
+
+        count_request(endpoint, 'retries')
+        wait = retry_after_seconds(response)
+        if wait is None:
+            wait = backoff_seconds(attempt)
+        if response is not None:
+            response.close()
+        time.sleep(wait)
+
+def api_get(url, jwt_token, params=None):
+    """GET a rentman API url (rate limited, retried) and return the response."""
+    headers = {
+        'Authorization': f"Bearer {jwt_token}"
+    }
+    return get_with_retry(url, headers=headers, params=params)
+
+def api_get_json(url, jwt_token, params=None):
+    """GET a rentman API url and return the decoded json. Raises requests.HTTPError if it failed for good."""
+    response = api_get(url, jwt_token, params=params)
+    response.raise_for_status()
+    return response.json()
+
+def api_list(url, jwt_token, params=None, limit=100, workers=LIST_PAGE_WORKERS):
+    """
+    List a rentman collection with limit and offset.
+    Fetches the first page right away and returns (total, pages): total is the number of
+    records the API reports ("itemCount", None if missing), pages a generator that yields
+    the records of each page as soon as it arrives. The other pages are fetched by up to
+    `workers` threads at the same time (still within the rate limit), so pages may arrive
+    out of order; at most `workers` pages are held in memory.
+    """
+    first = api_get_json(url, jwt_token, params=dict(params or {}, limit=limit, offset=0))
+    total = first.get('itemCount')
+    return total, list_pages(url, jwt_token, params, limit, workers, first.get('data', []), total)
+
+def list_pages(url, jwt_token, params, limit, workers, first_records, total):
+    yield first_records
+    if len(first_records) < limit:
+        return
+    if total is None:
+        # No count in the response: one page after the other until a page is not full
+        offset = limit
+        while True:
+            records = api_get_json(url, jwt_token, params=dict(params or {}, limit=limit, offset=offset)).get('data', [])
+            yield records
+            if len(records) < limit:
+                return
+            offset += limit
+
+    offsets = iter(range(limit, total, limit))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def submit_next():
+            offset = next(offsets, None)
+            if offset is not None:
+                pending.add(executor.submit(api_get_json, url, jwt_token, dict(params or {}, limit=limit, offset=offset)))
+
+        pending = set()
+        for _ in range(workers):
+            submit_next()
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                submit_next()
+                yield future.result().get('data', [])
+
+def api_get_pages(url, jwt_token, params=None, limit=100):
+    """Page through a rentman collection; yields the records of one page at a time (in any order)."""
+    _, pages = api_list(url, jwt_token, params=params, limit=limit)
+    yield from pages
+
+def file_get(url, stream=False, headers=None):
+    """GET a file (eg. from amazonS3). Retried, but not counted against the rentman rate limit."""
+    return get_with_retry(url, headers=headers, rate_limited=False, stream=stream)
+
+def file_head(url, headers=None):
+    """HEAD a file (eg. size and ETag of an amazonS3 object). Retried, not rate limited."""
+    return get_with_retry(url, headers=headers, rate_limited=False, method='HEAD')
+
+def print_request_stats():
+    """Print the per endpoint counters collected during this run."""
+    with stats_lock:
+        items = sorted(endpoint_stats.items())
+    if not items:
+        return
+    print("Requests per endpoint:")
+    for endpoint, stats in items:
+        average = stats['seconds'] / stats['requests'] if stats['requests'] else 0
+        print(f"   {endpoint:<40} {stats['requests']:>6} requests  {stats['retries']:>4} retries  {stats['errors']:>4} errors  {average * 1000:>7.1f} ms avg")
@@ -0,0 +1,162 @@
+import contextlib
+import json
+import os
+import threading
+import time
+
+# Where the time of a run goes, eg. {'download': {'count': 812, 'seconds': 97.3, 'max': 4.1}}
+stage_stats = {}
+# Time per equipment and stage, eg. {'1042': {'detail': 0.08, 'download': 1.3, ..}}
+item_stats = {}
+# Totals, eg. {'bytes_downloaded': 123456, 'rate_limit_wait_seconds': 12.5}
+counters = {}
+# Duration of every request per endpoint, for the percentiles
+latencies = {}
+metrics_lock = threading.Lock()
+
+# Equipment the current thread is working on (see measure_item)
+current = threading.local()
+
+
+def add_stage_time(stage, seconds, item=None):
+    item = item if item is not None else getattr(current, 'item', None)
+    with metrics_lock:
+        stats = stage_stats.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+        stats['count'] += 1
+        stats['seconds'] += seconds
+        stats['max'] = max(stats['max'], seconds)
+        if item is not None:
+            times = item_stats.setdefault(str(item), {})
+            times[stage] = times.get(stage, 0.0) + seconds
+
+@contextlib.contextmanager
+def timed(stage):
+    """Measure a block: with timed('download'): .."""
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        add_stage_time(stage, time.monotonic() - started)
+
+@contextlib.contextmanager
+def measure_item(item_code):
+    """Count the stages measured by this thread inside the block for item_code."""
+    previous = getattr(current, 'item', None)
+    current.item = item_code
+    try:
+        yield
+    finally:
+        current.item = previous
+
+def count(name, value=1):
+    with metrics_lock:
+        counters[name] = counters.get(name, 0) + value
+
+def record_latency(endpoint, seconds):
+    with metrics_lock:
+        latencies.setdefault(endpoint, []).append(seconds)
+
+def take_snapshot():
+    """All measurements of this process since the last snapshot (and reset them)."""
+    with metrics_lock:
+        snapshot = {'stages': dict(stage_stats), 'items': dict(item_stats), 'counters': dict(counters)}
+        stage_stats.clear()
+        item_stats.clear()
+        counters.clear()
+    return snapshot
+
+def merge_snapshot(snapshot):
+    """Add the measurements of a render process to the ones of this process."""
+    with metrics_lock:
+        for stage, other in snapshot['stages'].items():
+            stats = stage_stats.setdefault(stage, {'count': 0, 'seconds': 0.0, 'max': 0.0})
+            stats['count'] += other['count']
+            stats['seconds'] += other['seconds']
+            stats['max'] = max(stats['max'], other['max'])
+        for item, times in snapshot['items'].items():
+            item_times = item_stats.setdefault(item, {})
+            for stage, seconds in times.items():
+                item_times[stage] = item_times.get(stage, 0.0) + seconds
+        for name, value in snapshot['counters'].items():
+            counters[name] = counters.get(name, 0) + value
+
+def run_measured(item_code, function, *args, **kwargs):
+    """
+    Run function in a worker process and return (its result, what was measured meanwhile),
+    so the main process can merge_snapshot() the timings of the render stage.
+    """
+    take_snapshot()  # Nothing left over from an earlier task of this process
+    with measure_item(item_code):
+        result = function(*args, **kwargs)
+    return result, take_snapshot()
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else 0.0
+
+def collect(elapsed, endpoint_stats):
+    """All metrics of the run as one dict (written as JSON)."""
+    with metrics_lock:
+        endpoints = {}
+        for endpoint, stats in endpoint_stats.items():
+            samples = latencies.get(endpoint, [])
+            endpoints[endpoint] = dict(stats, p50=percentile(samples, 0.5), p95=percentile(samples, 0.95),
+                                       max=max(samples) if samples else 0.0)
+        return {
+            'elapsed_seconds': elapsed,
+            'stages': {stage: dict(stats) for stage, stats in stage_stats.items()},
+            'counters': dict(counters),
+            'endpoints': endpoints,
+            'items': {item: dict(times) for item, times in item_stats.items()},
+        }
+
+def print_summary(metrics):
+    """Summary table of a run, eg. printed at the end of collectEverything.py."""
+    elapsed = metrics['elapsed_seconds']
+    print(f"\nRun took {elapsed:.1f}s")
+    if metrics['stages']:
+        print(f"   {'Stage':<20} {'count':>7} {'total s':>9} {'avg ms':>9} {'max ms':>9}")
+        for stage, stats in sorted(metrics['stages'].items(), key=lambda entry: -entry[1]['seconds']):
+            average = stats['seconds'] / stats['count'] if stats['count'] else 0
+            print(f"   {stage:<20} {stats['count']:>7} {stats['seconds']:>9.1f} {average * 1000:>9.1f} {stats['max'] * 1000:>9.1f}")
+    if metrics['endpoints']:
+        print(f"   {'Endpoint':<30} {'requests':>8} {'retries':>8} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+        for endpoint, stats in sorted(metrics['endpoints'].items()):
+            print(f"   {endpoint:<30} {stats['requests']:>8} {stats['retries']:>8} {stats['errors']:>7} "
+                  f"{stats['p50'] * 1000:>8.1f} {stats['p95'] * 1000:>8.1f} {stats['max'] * 1000:>8.1f}")
+    counters = metrics['counters']
+    print(f"   Downloaded {counters.get('bytes_downloaded', 0) / 1024 ** 2:.1f} MB, "
+          f"waited {counters.get('rate_limit_wait_seconds', 0):.1f}s for the rate limit")
+
+def prometheus_lines(metrics):
+    """The metrics in the Prometheus text format (for the node_exporter textfile collector)."""
+    lines = [
+        '# TYPE rentman_export_elapsed_seconds gauge',
+        f"rentman_export_elapsed_seconds {metrics['elapsed_seconds']:.3f}",
+        '# TYPE rentman_export_stage_seconds gauge',
+    ]
+    lines += [f'rentman_export_stage_seconds{{stage="{stage}"}} {stats["seconds"]:.3f}' for stage, stats in sorted(metrics['stages'].items())]
+    lines.append('# TYPE rentman_export_stage_count gauge')
+    lines += [f'rentman_export_stage_count{{stage="{stage}"}} {stats["count"]}' for stage, stats in sorted(metrics['stages'].items())]
+    lines.append('# TYPE rentman_export_requests gauge')
+    for endpoint, stats in sorted(metrics['endpoints'].items()):
+        for key in ('requests', 'retries', 'errors'):
+            lines.append(f'rentman_export_requests{{endpoint="{endpoint}",type="{key}"}} {stats[key]}')
+    lines.append('# TYPE rentman_export_request_seconds gauge')
+    for endpoint, stats in sorted(metrics['endpoints'].items()):
+        for key in ('p50', 'p95', 'max'):
+            lines.append(f'rentman_export_request_seconds{{endpoint="{endpoint}",quantile="{key}"}} {stats[key]:.4f}')
+    for name, value in sorted(metrics['counters'].items()):
+        lines.append(f'# TYPE rentman_export_{name} gauge')
+        lines.append(f'rentman_export_{name} {value}')
+    return lines
+
+def write_metrics(path, metrics):
+    """Write the metrics as JSON, or in the Prometheus text format if path ends with .prom."""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        if path.endswith('.prom'):
+            f.write('\n'.join(prometheus_lines(metrics)) + '\n')
+        else:
+            json.dump(metrics, f, indent=4)
+    os.replace(tmp_path, path)  # The textfile collector must never read a half written file
@@ -0,0 +1,95 @@
+import os
+import re
+import contextlib
+from weasyprint import HTML, CSS
+from weasyprint.text.fonts import FontConfiguration
+
+TEMPLATE_PATH = 'equipment-sheet.html'
+
+# Only used when several sheets are laid out in one document (render_batch):
+# every sheet gets its own A4 page box, the absolute/fixed parts stay inside it.
+BATCH_CSS = """
+    .sheet { position: relative; height: 27.7cm; page-break-after: always; }
+    .sheet:last-child { page-break-after: auto; }
+    .sheet .logo { position: absolute; }
+"""
+
+
+class SheetRenderer:
+    """
+    Renders equipment sheets from equipment-sheet.html.
+    The template is read and split at its %%placeholders%% once, its <style> is parsed
+    once and the fonts are loaded once; all sheets rendered by the same renderer
+    (one per render process) share them.
+    """
+    def __init__(self, template_path=TEMPLATE_PATH):
+        with open(template_path, 'r') as file:
+            template = file.read()
+        self.font_config = FontConfiguration()
+        # Parse the <style> of the template once and pass it to every sheet as a ready stylesheet
+        style = re.search(r'<head>.*?<style>(.*?)</style>', template, flags=re.DOTALL)
+        self.css = CSS(string=style.group(1) if style else '', font_config=self.font_config)
+        self.batch_css = CSS(string=BATCH_CSS, font_config=self.font_config)
+        # The .html file keeps its <style>, the PDFs get the parsed stylesheet instead
+        self.file_parts = re.split(r'%%(\w+)%%', template)
+        if style:
+            template = template[:style.start(1) - len('<style>')] + template[style.end(1) + len('</style>'):]
+        self.render_parts = re.split(r'%%(\w+)%%', template)
+        body = re.search(r'<body>(.*)</body>', template, flags=re.DOTALL)
+        self.body_parts = re.split(r'%%(\w+)%%', body.group(1) if body else template)
+
+    @staticmethod
+    def fill_parts(parts, values):
+        # parts alternate between literal text and placeholder names; unknown placeholders stay as they are
+        return ''.join(part if i % 2 == 0 else str(values.get(part, f"%%{part}%%")) for i, part in enumerate(parts))
+
+    def fill(self, values):
+        """The sheet as complete HTML file, eg. {'name': .., 'code': ..} => '<!DOCTYPE html>…'"""
+        return self.fill_parts(self.file_parts, values)
+
+    def write_pdf(self, values, base_folder, pdf_path):
+        """Render one sheet; relative urls are resolved from base_folder."""
+        try:
+            # Make weasyprint silent (subpress all warnings)
+            with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+                HTML(string=self.fill_parts(self.render_parts, values), base_url=os.path.abspath(base_folder) + os.sep).write_pdf(
+                    pdf_path, stylesheets=[self.css], font_config=self.font_config)
+        except Exception as e:
+            print(f"      An error occurred: {e}")
+
+    def render_batch(self, sheets):
+        """
+        Lay out many sheets in one document and split it into one PDF per sheet.
+        sheets: list of (values, pdf_path); the values must contain absolute urls (file://…),
+        because the sheets come from different folders.
+        """
+        if not sheets:
+            return
+        body = ''.join(f'<div class="sheet" id="sheet-{index}">{self.fill_parts(self.body_parts, values)}</div>'
+                       for index, (values, _) in enumerate(sheets))
+        try:
+            with open(os.devnull, 'w') as f, contextlib.redirect_stdout(f), contextlib.redirect_stderr(f):
+                document = HTML(string=f'<!DOCTYPE html><html><head><meta charset="utf-8"></head><body>{body}</body></html>').render(
+                    stylesheets=[self.css, self.batch_css], font_config=self.font_config)
+                # Find the first page of every sheet by its anchor
+                first_pages = {}
+                for page_number, page in enumerate(document.pages):
+                    for anchor in page.anchors:
+                        if anchor.startswith('sheet-'):
+                            first_pages.setdefault(int(anchor[len('sheet-'):]), page_number)
+                for index, (_, pdf_path) in enumerate(sheets):
+                    start = first_pages[index]
+                    end = first_pages.get(index + 1, len(document.pages))
+                    document.copy(document.pages[start:max(end, start + 1)]).write_pdf(pdf_path)
+        except Exception as e:
+            print(f"      An error occurred: {e}")
+
+
+# One renderer per process, created on first use
+sheet_renderer = None
+
+def get_sheet_renderer():
+    global sheet_renderer
+    if sheet_renderer is None:
+        sheet_renderer = SheetRenderer()
+    return sheet_renderer